@@ -1,31 +1,41 @@
 import streamlit as st
 import pandas as pd
-import qrcode
-from PIL import Image
-import io
 import uuid
 from datetime import date, datetime
 from dateutil.relativedelta import relativedelta
 import database as db
-import cv2  # OpenCV for drawing on the video feed
-import numpy as np
-from streamlit_webrtc import webrtc_streamer, WebRtcMode, RTCConfiguration
-import threading
+import diagnostics
+import scheduler
+import functools
 import time
+# Heavier modules (OpenCV and streamlit-webrtc for the scanner, qrcode, Pillow, pyarrow,
+# openpyxl) are imported inside the pages that use them, so the login page and the
+# dashboard don't pay for them on a cold start.
 
 # --- App Configuration ---
 st.set_page_config(page_title="Member Management System", layout="wide")
 
-# --- Thread-Safe Container for Scanner Result ---
-# This is necessary because the webrtc component runs in a separate thread.
-result_lock = threading.Lock()
-scanned_member_id_container = {"id": None}
+# --- Scanner Result Delivery ---
+# The webrtc component runs in a separate thread; each session gets its own
+# ScanChannel (and QRScanner) in session_state, so concurrent scans don't collide.
+# The script thread waits on the channel for at most this many seconds at a time.
+SCAN_WAIT_TIMEOUT = 1.0
+# How long a "member not found" error stays up before the prompt is restored
+SCAN_ERROR_DISPLAY_SECONDS = 3.0
+# How long the kiosk shows a check-in result before going back to "ready"
+KIOSK_RESULT_DISPLAY_SECONDS = 4.0
 
 # --- RTC Configuration for Deployment ---
 # This helps the video stream work better on deployed servers (like Streamlit Cloud)
-RTC_CONFIGURATION = RTCConfiguration(
-    {"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]}
-)
+# (A plain dict; streamlit_webrtc's RTCConfiguration is a TypedDict.)
+RTC_CONFIGURATION = {"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]}
+
+# Number of search matches shown per page in the member selector
+SEARCH_PAGE_SIZE = 50
+# Renewal history entries shown per page on a member's history tab
+HISTORY_PAGE_SIZE = 10
+# Upper bound on cards rendered in one batch job
+MAX_CARDS_PER_JOB = 10000
 
 # --- Helper Functions ---
 def calculate_age(born):
@@ -34,15 +44,9 @@ def calculate_age(born):
     return today.year - born.year - ((today.month, today.day) < (born.month, born.day))
 
 def generate_qr_code(data):
-    """Generates a QR code image from data and returns it as bytes."""
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(data)
-    qr.make(fit=True)
-    img = qr.make_image(fill='black', back_color='white')
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    byte_im = buf.getvalue()
-    return byte_im
+    """Returns a QR code image for data as PNG bytes, served from the shared QR cache."""
+    from qr_codes import qr_cache
+    return qr_cache.get(data)
 
 # --- Super Admin Authentication ---
 def login():
@@ -63,39 +67,72 @@ def login():
                 st.error("Incorrect username or password")
 
 # --- QR Code Scanner Video Callback (OpenCV Version) ---
-def video_frame_callback(frame):
+def video_frame_callback(frame, scanner, channel, dedup):
     """
     Decodes QR codes using OpenCV's built-in detector.
     This avoids the need for the external ZBar library.
+    Member IDs are looked up in the in-memory ID index (no database access on this thread)
+    and published to the session's ScanChannel at most once per dedup cooldown.
     """
     img = frame.to_ndarray(format="bgr24")
     
-    # Initialize the QRCodeDetector
-    qr_decoder = cv2.QRCodeDetector()
-    
-    # Detect and decode the QR code
-    data, bbox, _ = qr_decoder.detectAndDecode(img)
+    # Detect and decode the QR code (downscaled, strided, ROI-first; see scanner.py)
+    result = scanner.process(img)
     
-    if bbox is not None and data:
-        # `bbox` is a numpy array of float points
-        points = bbox[0]
-        # Convert points to integer for drawing
-        pts = np.array([points], np.int32).reshape((-1, 1, 2))
-        
-        # Check if it's a valid Member ID format
+    if result is not None:
+        data = result.data
+        # Check if it's a Member ID, and whether that member exists
         if data.startswith("MEM-"):
-            with result_lock:
-                scanned_member_id_container["id"] = data
+            known = data in db.member_ids
+            if dedup.accept(data):
+                channel.publish(data)
             
-            # Draw a green box and text for a successful scan
-            cv2.polylines(img, [pts], True, (0, 255, 0), 3)
-            cv2.putText(img, "Member Found!", (int(points[0][0]), int(points[0][1]) - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+            # Draw a green box for a known member, orange for an unknown ID
+            color, label = ((0, 255, 0), "Member Found!") if known else ((0, 165, 255), "Unknown Member")
+            _draw_scan_box(img, result.points, color, label)
         else:
             # Draw a red box for an invalid QR code
-            cv2.polylines(img, [pts], True, (0, 0, 255), 3)
-            cv2.putText(img, "Invalid QR Code", (int(points[0][0]), int(points[0][1]) - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+            _draw_scan_box(img, result.points, (0, 0, 255), "Invalid QR Code")
             
     return frame.from_ndarray(img, format="bgr24")
+
+def _draw_scan_box(img, points, color, label):
+    """Outlines a detected code (float corner points) and writes a label above it."""
+    import cv2  # OpenCV for drawing on the video feed
+    import numpy as np
+    pts = np.array([points], np.int32).reshape((-1, 1, 2))
+    cv2.polylines(img, [pts], True, color, 3)
+    cv2.putText(img, label, (int(points[0][0]), int(points[0][1]) - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
+
+# Overlay colour (BGR) and label for each kiosk check-in status
+KIOSK_OVERLAYS = {
+    "valid": ((0, 255, 0), "VALID"),
+    "expired": ((0, 0, 255), "EXPIRED"),
+    "unknown": ((0, 165, 255), "Unknown Member"),
+    "invalid": ((0, 0, 255), "Invalid QR Code"),
+}
+
+def kiosk_frame_callback(frame, scanner, station, channel, dedup):
+    """
+    Video callback for the kiosk: every decoded code goes through the session's
+    KioskStation, which queues an attendance row for new check-ins (the database
+    write happens later, in batches, on the attendance writer thread). The result is
+    drawn on every frame, but only published to the page when it is a new check-in or
+    `dedup` (a KIOSK_RESULT_DISPLAY_SECONDS window) lets a repeat through, so a card held
+    up doesn't overwrite its own check-in with "already checked in" repeats.
+    """
+    img = frame.to_ndarray(format="bgr24")
+    result = scanner.process(img)
+    if result is not None:
+        check_in = station.check_in(result.data)
+        color, label = KIOSK_OVERLAYS[check_in.status]
+        if check_in.name:
+            label = f"{check_in.name} - {label}"
+        _draw_scan_box(img, result.points, color, label)
+        if dedup.accept(check_in.member_id) or check_in.recorded:
+            channel.publish(check_in)
+    return frame.from_ndarray(img, format="bgr24")
+
 # --- Main Application UI ---
 def main_app():
     st.sidebar.title(f"Welcome, Admin!")
@@ -103,7 +140,7 @@ def main_app():
     
     page = st.sidebar.radio(
         "Navigation",
-        ["Dashboard", "View/Manage Members", "Add New Member", "Manage Departments"]
+        ["Dashboard", "View/Manage Members", "Add New Member", "Batch Renewals", "Kiosk Check-In", "Member Cards", "Import Members", "Export Data", "Manage Departments", "Diagnostics"]
     )
     st.sidebar.markdown("---")
     if st.sidebar.button("Logout"):
@@ -112,48 +149,82 @@ def main_app():
             del st.session_state[key]
         st.rerun()
 
-    if page == "Dashboard":
-        display_dashboard()
-    elif page == "View/Manage Members":
-        display_manage_members()
-    elif page == "Add New Member":
-        display_add_member()
-    elif page == "Manage Departments":
-        display_manage_departments()
+    # Every page render is timed for the Diagnostics page. (A render that ends in
+    # st.rerun() is still recorded, since the rerun exception passes through here.)
+    with diagnostics.timed("page", page):
+        if page == "Dashboard":
+            display_dashboard()
+        elif page == "View/Manage Members":
+            display_manage_members()
+        elif page == "Add New Member":
+            display_add_member()
+        elif page == "Batch Renewals":
+            display_batch_renewals()
+        elif page == "Kiosk Check-In":
+            display_kiosk()
+        elif page == "Member Cards":
+            display_member_cards()
+        elif page == "Import Members":
+            display_import_members()
+        elif page == "Export Data":
+            display_export_data()
+        elif page == "Manage Departments":
+            display_manage_departments()
+        elif page == "Diagnostics":
+            display_diagnostics()
 
 def display_dashboard():
     st.title("📊 Dashboard")
     st.markdown("---")
     
-    all_members = db.get_all_members()
-    total_members = len(all_members)
-    
-    renewals_due_next_30_days = 0
-    expired_members = 0  # New variable for expired members
-    if all_members:
-        today = date.today()
-        for member in all_members:
-            renewal_date = datetime.strptime(member['next_renewal_date'], "%Y-%m-%d").date()
-            if 0 <= (renewal_date - today).days <= 30:
-                renewals_due_next_30_days += 1
-            if renewal_date < today:
-                expired_members += 1  # Count expired members
-            
+    # Figures come from snapshots kept fresh by the background scheduler (scheduler.py);
+    # they are computed directly when there is no recent snapshot or the scheduler isn't running
+    stats, computed_at = scheduler.current_snapshot("dashboard_stats")
+
     col1, col2, col3 = st.columns(3)  # Add a third column for expired members
-    col1.metric("Total Members", f"{total_members} 👥")
-    col2.metric("Renewals Due (Next 30 Days)", f"{renewals_due_next_30_days} 🗓️")
-    col3.metric("Expired Members", f"{expired_members} ❌")  # Display expired members
+    col1.metric("Total Members", f"{stats['total_members']} 👥")
+    col2.metric("Renewals Due (Next 30 Days)", f"{stats['due_soon']} 🗓️")
+    col3.metric("Expired Members", f"{stats['expired']} ❌")  # Display expired members
+    st.caption(f"As of {computed_at:%b %d, %Y %H:%M:%S}")
+
+    expiries, _ = scheduler.current_snapshot("upcoming_expiries")
+    departments, _ = scheduler.current_snapshot("department_totals")
+    expiry_col, department_col = st.columns(2)
+    with expiry_col:
+        st.subheader("Upcoming Expiries")
+        if not expiries["members"]:
+            st.info("No memberships expire in the next 30 days.")
+        else:
+            st.dataframe(pd.DataFrame(expiries["members"]), use_container_width=True, hide_index=True)
+    with department_col:
+        st.subheader("Members by Department")
+        st.dataframe(pd.DataFrame(departments["departments"]), use_container_width=True, hide_index=True)
 
     st.subheader("Recent Members")
-    if all_members:
+    recent_members = db.get_recent_members(limit=5)
+    if recent_members:
         # Convert list of sqlite3.Row objects to list of dicts for Pandas
-        members_list_of_dicts = [dict(row) for row in all_members]
-        df = pd.DataFrame(members_list_of_dicts)
-        st.dataframe(df[['member_id', 'name', 'department', 'member_since', 'next_renewal_date']].tail(), use_container_width=True)
+        with diagnostics.timed("dataframe", "dashboard_recent_members"):
+            df = pd.DataFrame([dict(row) for row in recent_members])
+        st.dataframe(df[['member_id', 'name', 'department', 'member_since', 'next_renewal_date']], use_container_width=True)
     else:
         st.info("No members found.")
 
+    st.subheader("Renewals per Month (Last 12 Months)")
+    # Read from the precomputed monthly summary, so this doesn't grow with the history
+    start_month = (date.today().replace(day=1) - relativedelta(months=11)).strftime('%Y-%m')
+    summary = db.get_renewal_summary(start_month=start_month)
+    if summary:
+        with diagnostics.timed("dataframe", "dashboard_renewal_trend"):
+            trend = pd.DataFrame([dict(row) for row in summary])
+            trend['department'] = trend['department'].replace('', 'No Department')
+            trend = trend.pivot(index='month', columns='department', values='renewals').fillna(0)
+        st.bar_chart(trend)
+    else:
+        st.info("No renewals in the last 12 months.")
+
 def display_add_member():
+    import photos
     st.title("➕ Add New Member")
     st.markdown("---")
     
@@ -184,7 +255,14 @@ def display_add_member():
                 st.error("Please fill in all required fields (*).")
             else:
                 member_id = f"MEM-{uuid.uuid4().hex[:8].upper()}"
-                profile_pic_bytes = profile_pic_file.read() if profile_pic_file else None
+                profile_pic_bytes = thumbnail_bytes = None
+                if profile_pic_file:
+                    try:
+                        # Resize, fix orientation and re-encode before storing (see photos.py)
+                        profile_pic_bytes, thumbnail_bytes = photos.process_profile_pic(profile_pic_file.read())
+                    except ValueError as e:
+                        st.error(f"Could not read the profile picture: {e}")
+                        return
                 next_renewal_date = member_since + relativedelta(years=1)
                 
                 member_data = {
@@ -192,107 +270,351 @@ def display_add_member():
                     "email": email, "phone": phone, "address": address, "department": department,
                     "member_since": member_since.strftime("%Y-%m-%d"),
                     "next_renewal_date": next_renewal_date.strftime("%Y-%m-%d"),
-                    "profile_pic": profile_pic_bytes
+                    "profile_pic": profile_pic_bytes, "profile_pic_thumbnail": thumbnail_bytes
                 }
                 
                 db.add_member(member_data)
                 st.success(f"Successfully added member: {name} (ID: {member_id})")
                 st.balloons()
 
+def display_batch_renewals():
+    st.title("🔄 Batch Renewals")
+    st.markdown("---")
+
+    mode = st.radio("Renew", ["A whole department", "Everyone expiring in a date window"], horizontal=True)
+    if mode == "A whole department":
+        department = st.selectbox("Department", options=db.get_all_departments())
+        member_ids = db.get_member_ids_for_renewal(department=department)
+        target_label = f"all members of {department}"
+    else:
+        window_col1, window_col2 = st.columns(2)
+        expiring_from = window_col1.date_input("Expiring from", value=date.today() - relativedelta(months=1))
+        expiring_until = window_col2.date_input("Expiring until", value=date.today() + relativedelta(months=1))
+        member_ids = db.get_member_ids_for_renewal(expiring_from=expiring_from, expiring_until=expiring_until)
+        target_label = f"members expiring between {expiring_from:%b %d, %Y} and {expiring_until:%b %d, %Y}"
+
+    years = st.number_input("Renewal period (years)", min_value=1, max_value=5, value=1)
+    st.info(f"{len(member_ids)} member(s) selected: {target_label}.")
+    if not member_ids:
+        return
+
+    if st.checkbox(f"I confirm I want to renew {len(member_ids)} member(s) for {years} year(s)"):
+        if st.button("Renew Selected Members", type="primary"):
+            summary = db.renew_members(member_ids, relativedelta(years=years), notes="Batch renewal")
+            st.success(f"Renewed {summary['renewed']} of {summary['requested']} member(s).")
+            if summary['not_found']:
+                st.warning(f"{len(summary['not_found'])} member(s) no longer exist and were skipped.")
+
+def _show_check_in(box, check_in):
+    """Shows one kiosk check-in result in a placeholder."""
+    repeat = "" if check_in.recorded else " (already checked in)"
+    if check_in.status == "valid":
+        renews = datetime.strptime(check_in.next_renewal_date, '%Y-%m-%d').strftime('%B %d, %Y')
+        box.success(f"### ✅ Welcome, {check_in.name}!{repeat}\nMembership valid until {renews}.")
+    elif check_in.status == "expired":
+        expired = datetime.strptime(check_in.next_renewal_date, '%Y-%m-%d').strftime('%B %d, %Y')
+        box.error(f"### ❌ {check_in.name}: membership expired{repeat}\nExpired on {expired}. Please see the front desk to renew.")
+    elif check_in.status == "unknown":
+        box.warning(f"### ⚠️ Member ID '{check_in.member_id}' not recognised.")
+    else:
+        box.warning("### ⚠️ This is not a member QR code.")
+
+def display_kiosk():
+    import attendance
+    from scanner import ScanChannel, ScanDeduplicator, scanner_from_env
+    from streamlit_webrtc import webrtc_streamer, WebRtcMode
+    st.title("🎟️ Kiosk Check-In")
+    st.markdown("---")
+
+    station_name = st.text_input("Station name", value="Main Entrance", key="kiosk_station_name")
+    if st.session_state.get("kiosk_station") is None or st.session_state.kiosk_station.station != station_name:
+        st.session_state.kiosk_station = attendance.KioskStation(station_name)
+        st.session_state.kiosk_dedup = ScanDeduplicator(KIOSK_RESULT_DISPLAY_SECONDS)
+    if "kiosk_channel" not in st.session_state: st.session_state.kiosk_channel = ScanChannel()
+    if "kiosk_scanner" not in st.session_state: st.session_state.kiosk_scanner = scanner_from_env()
+    station, channel = st.session_state.kiosk_station, st.session_state.kiosk_channel
+    # Load the member ID index now rather than on the video thread's first scan
+    db.member_ids.load()
+
+    col1, col2, col3 = st.columns(3)
+    today_metric, session_metric, buffered_metric = col1.empty(), col2.empty(), col3.empty()
+
+    def refresh_metrics():
+        writer_stats = attendance.writer.get_stats()
+        # Check-ins still in the write buffer aren't in the table yet
+        today_metric.metric("Check-ins Today", db.count_attendance() + writer_stats["buffered"])
+        session_metric.metric("This Station (Session)", station.check_ins)
+        buffered_metric.metric("Waiting to be Saved", writer_stats["buffered"])
+
+    refresh_metrics()
+    webrtc_ctx = webrtc_streamer(key="kiosk", mode=WebRtcMode.SENDRECV,
+                                 rtc_configuration=RTC_CONFIGURATION,
+                                 video_frame_callback=functools.partial(kiosk_frame_callback, scanner=st.session_state.kiosk_scanner,
+                                                                        station=station, channel=channel,
+                                                                        dedup=st.session_state.kiosk_dedup),
+                                 media_stream_constraints={"video": True, "audio": False},
+                                 async_processing=True)
+    result_box = st.empty()
+    st.subheader("Recent Check-ins")
+    recent_box = st.empty()
+
+    def show_recent():
+        if station.recent:
+            recent = pd.DataFrame([{"time": c.at.strftime('%H:%M:%S'), "member_id": c.member_id, "name": c.name,
+                                    "status": c.status} for c in list(station.recent)])
+            recent_box.dataframe(recent, use_container_width=True, hide_index=True)
+        else:
+            rows = db.get_recent_attendance(limit=20, since=date.today())
+            if rows:
+                recent_box.dataframe(pd.DataFrame([dict(r) for r in rows]), use_container_width=True, hide_index=True)
+            else:
+                recent_box.info("No check-ins yet today.")
+
+    show_recent()
+    if not webrtc_ctx.state.playing:
+        result_box.warning("Camera is not active. Press START (and allow camera access) to open the kiosk.")
+        return
+
+    # Runs for as long as the camera does. Results arrive from the video thread; the
+    # page only redraws, it never writes to the database itself.
+    result_box.info("### Ready. Hold your member QR code up to the camera.")
+    shown_at = None
+    while webrtc_ctx.state.playing:
+        check_in = channel.wait(timeout=SCAN_WAIT_TIMEOUT)
+        if check_in:
+            _show_check_in(result_box, check_in)
+            shown_at = time.monotonic()
+            if check_in.recorded:
+                show_recent()
+        elif shown_at and time.monotonic() - shown_at >= KIOSK_RESULT_DISPLAY_SECONDS:
+            result_box.info("### Ready. Hold your member QR code up to the camera.")
+            shown_at = None
+        refresh_metrics()
+    st.rerun()
+
+def display_member_cards():
+    import member_cards
+    st.title("🪪 Member Cards")
+    st.markdown("---")
+    st.markdown("Generate printable cards (name, ID, photo and QR code) for a department or a search.")
+
+    department = st.selectbox("Department", options=["All Departments"] + db.get_all_departments())
+    department = None if department == "All Departments" else department
+    search_query = st.text_input("Only members matching (optional)", placeholder="Name, ID, email or phone")
+    fmt = st.radio("Output", ["ZIP of PNG cards", "PDF (10 cards per A4 page)"], horizontal=True)
+    fmt = "zip" if fmt.startswith("ZIP") else "pdf"
+
+    if st.button("Generate Cards", type="primary"):
+        matching_ids = {m['member_id'] for m in db.search_members(search_query, limit=MAX_CARDS_PER_JOB)} if search_query else None
+        members = [row for chunk in db.iter_members(department=department) for row in chunk
+                   if matching_ids is None or row['member_id'] in matching_ids][:MAX_CARDS_PER_JOB]
+        if not members:
+            st.warning("No members match this selection.")
+            return
+
+        progress_bar = st.progress(0.0, text=f"Rendering {len(members)} cards...")
+        cards_file = member_cards.generate_cards(
+            members, fmt=fmt,
+            progress=lambda done, total: progress_bar.progress(done / total, text=f"Rendered {done} of {total} cards..."))
+        progress_bar.empty()
+        st.session_state.cards_file = (cards_file, fmt, len(members))
+
+    # Keep the last result downloadable across reruns (clicking download reruns the script)
+    if st.session_state.get("cards_file"):
+        cards_file, cards_fmt, count = st.session_state.cards_file
+        cards_file.seek(0)
+        st.success(f"{count} card(s) ready.")
+        st.download_button(f"Download Cards ({cards_fmt.upper()})", data=cards_file,
+                           file_name=f"member_cards_{date.today():%Y%m%d}.{cards_fmt}",
+                           mime="application/zip" if cards_fmt == "zip" else "application/pdf")
+
+def display_import_members():
+    import member_import
+    st.title("📥 Import Members")
+    st.markdown("---")
+    st.markdown("Upload a CSV or Excel file with the columns **name**, **dob** and **department** "
+                "(optional: email, phone, address, member_since). Dates should be YYYY-MM-DD.")
+
+    uploaded_file = st.file_uploader("Member spreadsheet", type=['csv', 'xlsx'])
+    dry_run = st.checkbox("Dry run (validate only, don't save)", value=True)
+    if not uploaded_file or not st.button("Validate & Import", type="primary"):
+        return
+
+    try:
+        df = member_import.read_member_file(uploaded_file, uploaded_file.name)
+        valid, report = member_import.validate_members(df, db.get_all_departments())
+    except ValueError as e:
+        st.error(f"Could not read file: {e}")
+        return
+
+    error_count = len(report) - len(valid)
+    if valid.empty:
+        st.error("No valid rows to import.")
+    else:
+        progress_bar = st.progress(0.0, text="Importing members...")
+        added = member_import.import_members(
+            valid, dry_run=dry_run,
+            progress=lambda done, total: progress_bar.progress(done / total, text=f"Imported {done} of {total} members..."))
+        progress_bar.empty()
+        if dry_run:
+            st.info(f"Dry run: {added} member(s) would be imported, {error_count} row(s) have errors.")
+        else:
+            st.success(f"Imported {added} member(s). {error_count} row(s) skipped due to errors.")
+
+    st.subheader("Validation Report")
+    st.dataframe(report, use_container_width=True, hide_index=True)
+    st.download_button("Download Report", data=report.to_csv(index=False), file_name="import_report.csv", mime="text/csv")
+
+def display_export_data():
+    import export
+    st.title("📤 Export Data")
+    st.markdown("---")
+
+    dataset = st.radio("Dataset", ["Members", "Renewal History"], horizontal=True)
+    fmt = st.radio("Format", ["CSV", "Parquet"], horizontal=True).lower()
+    department = st.selectbox("Department", options=["All Departments"] + db.get_all_departments())
+    department = None if department == "All Departments" else department
+
+    date_label = "Member since" if dataset == "Members" else "Renewed to"
+    start_date = end_date = None
+    if st.checkbox(f"Filter by date ({date_label.lower()})"):
+        date_col1, date_col2 = st.columns(2)
+        start_date = date_col1.date_input(f"{date_label} from", value=date.today() - relativedelta(years=1))
+        end_date = date_col2.date_input(f"{date_label} until", value=date.today())
+    include_photos = dataset == "Members" and st.checkbox("Include profile pictures (much larger file)")
+
+    # The export is only generated when the button is clicked, chunk by chunk from the database
+    if dataset == "Members":
+        build_export = lambda: export.export_members(fmt, department, start_date, end_date, include_photos)
+    else:
+        build_export = lambda: export.export_renewal_history(fmt, department, start_date, end_date)
+    file_stem = "members" if dataset == "Members" else "renewal_history"
+    st.download_button(label=f"Download {dataset} ({fmt.upper()})", data=build_export,
+                       file_name=f"{file_stem}_{date.today():%Y%m%d}.{fmt}",
+                       mime="text/csv" if fmt == "csv" else "application/vnd.apache.parquet")
+
 def display_manage_members():
+    import photos
+    from qr_codes import qr_cache
     st.title("🔍 View / Manage Members")
 
-    # Initialize session state for this page
+    # Initialize session state for this page (scanner state is created when the scanner is opened)
     if "show_scanner" not in st.session_state: st.session_state.show_scanner = False
     if "selected_member_id" not in st.session_state: st.session_state.selected_member_id = None
 
-    members = db.get_all_members()
-    if not members:
+    if "search_page" not in st.session_state: st.session_state.search_page = 0
+
+    if db.count_search_results("") == 0:
         st.warning("No members found. Please add a new member.")
         return
 
-    member_dict = {f"{m['name']} ({m['member_id']})": m['member_id'] for m in members}
-    member_id_to_display = {v: k for k, v in member_dict.items()}
-
     # --- SEARCH AND SCANNER UI ---
     search_col, scan_col = st.columns([3, 1])
     with search_col:
-        search_query = st.text_input("Search by Name or ID", key="search_text")
+        search_query = st.text_input("Search by Name, ID, Email or Phone", key="search_text",
+                                     on_change=lambda: st.session_state.update(search_page=0))
     with scan_col:
         st.write("")
         st.write("")
         if st.button("📷 Scan QR to Search", use_container_width=True):
             # Toggle scanner and reset any previous result
             st.session_state.show_scanner = not st.session_state.show_scanner
-            with result_lock:
-                scanned_member_id_container["id"] = None
+            if "scan_channel" in st.session_state:
+                st.session_state.scan_channel.clear()
+                st.session_state.scan_dedup.reset()
             st.rerun()
 
-    # --- DISPLAY QR SCANNER AND POLLING LOGIC ---
+    # --- DISPLAY QR SCANNER AND SCAN HANDLING ---
     if st.session_state.show_scanner:
+        from scanner import ScanChannel, scanner_from_env, deduplicator_from_env
+        from streamlit_webrtc import webrtc_streamer, WebRtcMode
+        if "scan_channel" not in st.session_state: st.session_state.scan_channel = ScanChannel()
+        if "qr_scanner" not in st.session_state: st.session_state.qr_scanner = scanner_from_env()
+        if "scan_dedup" not in st.session_state: st.session_state.scan_dedup = deduplicator_from_env()
+
         st.subheader("QR Code Scanner")
+        qr_scanner = st.session_state.qr_scanner
+        scan_channel = st.session_state.scan_channel
+        # Load the member ID index here rather than on the video thread's first scan
+        db.member_ids.load()
         webrtc_ctx = webrtc_streamer(key="qr-scanner", mode=WebRtcMode.SENDRECV,
                                      rtc_configuration=RTC_CONFIGURATION,
-                                     video_frame_callback=video_frame_callback,
+                                     video_frame_callback=functools.partial(video_frame_callback, scanner=qr_scanner, channel=scan_channel,
+                                                                            dedup=st.session_state.scan_dedup),
                                      media_stream_constraints={"video": True, "audio": False},
                                      async_processing=True)
         
         status_indicator = st.empty()
+        scanner_stats = st.empty()
 
-        # This block is the core of the solution. It actively polls for a result.
+        # Wait for scan events from the video thread. wait() wakes up as soon as a code is
+        # published, or after SCAN_WAIT_TIMEOUT to refresh stats and check the camera state.
         if webrtc_ctx.state.playing:
             status_indicator.info("Camera is active. Looking for a QR code...")
+            error_shown_at = None
             
-            # Loop to check for the scanned ID from the callback
-            while True:
-                with result_lock:
-                    scanned_id = scanned_member_id_container["id"]
+            while webrtc_ctx.state.playing:
+                scanned_id = scan_channel.wait(timeout=SCAN_WAIT_TIMEOUT)
+                stats = qr_scanner.get_stats()
+                scanner_stats.caption(f"Decode: {stats['last_decode_ms']:.1f} ms (avg {stats['avg_decode_ms']:.1f} ms) · "
+                                      f"Frames: {stats['frames_seen']} seen, {stats['frames_dropped']} dropped")
                 
                 if scanned_id:
-                    member = db.get_member_by_id(scanned_id)
+                    member = db.get_member_by_id(scanned_id) if scanned_id in db.member_ids else None
                     if member:
                         # --- SUCCESS: ID FOUND AND VALID ---
-                        status_indicator.success(f"Member Found: {member['name']}. Loading...")
                         st.session_state.selected_member_id = scanned_id
                         st.session_state.show_scanner = False
-                        
-                        # Clean up the container for the next scan
-                        with result_lock:
-                            scanned_member_id_container["id"] = None
-                        
-                        # Give user a moment to see the success message before rerun
-                        time.sleep(1.5)
+                        # A toast survives the rerun, so there is no need to pause here
+                        st.toast(f"Member Found: {member['name']}", icon="✅")
                         st.rerun()
                     else:
                         # --- ERROR: ID SCANNED BUT NOT IN DATABASE ---
                         status_indicator.error(f"Error: Member ID '{scanned_id}' not found. Please scan another code.")
-                        with result_lock:
-                            scanned_member_id_container["id"] = None # Reset for re-scan
-                        time.sleep(3) # Wait for user to read the message
-                        status_indicator.info("Camera is active. Looking for a QR code...") # Reset message
-                
-                # Check if the component has been stopped manually by the user
-                if not webrtc_ctx.state.playing:
-                    st.session_state.show_scanner = False
-                    st.rerun()
-                    
-                time.sleep(0.2)  # Poll every 200ms to be responsive without high CPU usage
+                        error_shown_at = time.monotonic()
+                elif error_shown_at and time.monotonic() - error_shown_at >= SCAN_ERROR_DISPLAY_SECONDS:
+                    status_indicator.info("Camera is active. Looking for a QR code...") # Reset message
+                    error_shown_at = None
+            
+            # The component has been stopped manually by the user
+            st.session_state.show_scanner = False
+            st.rerun()
         else:
             status_indicator.warning("Camera is not active. Please grant permissions and start.")
 
     # --- MEMBER SELECTION AND DISPLAY LOGIC (This part is now driven by the scanner) ---
-    filtered_members = {k: v for k, v in member_dict.items() if search_query.lower() in k.lower()} if search_query else member_dict
-    
-    selected_index = 0
-    if st.session_state.selected_member_id and st.session_state.selected_member_id in member_id_to_display:
-        display_name = member_id_to_display[st.session_state.selected_member_id]
-        if display_name in filtered_members:
-            selected_index = list(filtered_members.keys()).index(display_name)
-    
+    # Only one page of matches is fetched and handed to the selectbox.
+    total_matches = db.count_search_results(search_query)
+    last_page = max((total_matches - 1) // SEARCH_PAGE_SIZE, 0)
+    page_no = min(st.session_state.search_page, last_page)
+    page_members = db.search_members(search_query, limit=SEARCH_PAGE_SIZE, offset=page_no * SEARCH_PAGE_SIZE)
+    filtered_members = {f"{m['name']} ({m['member_id']})": m['member_id'] for m in page_members}
+
+    # Keep a scanned/previously selected member selectable even if it is on another page
+    selected_id = st.session_state.selected_member_id
+    if selected_id and not search_query and selected_id not in filtered_members.values():
+        selected = db.get_member_by_id(selected_id)
+        if selected:
+            filtered_members = {f"{selected['name']} ({selected['member_id']})": selected_id, **filtered_members}
+
     if not filtered_members:
         st.warning("No members match your search criteria.")
         return
-        
+
+    selected_index = 0
+    if selected_id in filtered_members.values():
+        selected_index = list(filtered_members.values()).index(selected_id)
+
+    if total_matches > SEARCH_PAGE_SIZE:
+        prev_col, info_col, next_col = st.columns([1, 3, 1])
+        if prev_col.button("◀ Previous", disabled=page_no == 0, use_container_width=True):
+            st.session_state.search_page = page_no - 1
+            st.rerun()
+        info_col.caption(f"Showing {page_no * SEARCH_PAGE_SIZE + 1}–{min((page_no + 1) * SEARCH_PAGE_SIZE, total_matches)} of {total_matches} matches")
+        if next_col.button("Next ▶", disabled=page_no >= last_page, use_container_width=True):
+            st.session_state.search_page = page_no + 1
+            st.rerun()
+
     selected_display = st.selectbox("Select a Member", options=list(filtered_members.keys()), index=selected_index, key="member_selector")
     if selected_display:
         st.session_state.selected_member_id = filtered_members[selected_display]
@@ -324,8 +646,8 @@ def display_manage_members():
             else:
                 st.success(f"**Next Renewal Date:** {renewal_date.strftime('%B %d, %Y')}")
         with qr_col:
-            if member['profile_pic']:
-                st.image(member['profile_pic'], caption="Profile Picture", width=200)
+            if member['profile_pic_hash']:
+                st.image(db.get_profile_pic(member['profile_pic_hash'], thumbnail=True), caption="Profile Picture", width=200)
             
             qr_bytes = generate_qr_code(member['member_id'])
             st.image(qr_bytes, caption="Member ID QR Code", width=200)
@@ -337,8 +659,7 @@ def display_manage_members():
             if st.button("Renew Membership for 1 Year"):
                 current_renewal = datetime.strptime(member['next_renewal_date'], "%Y-%m-%d").date()
                 new_renewal = current_renewal + relativedelta(years=1)
-                db.update_renewal_date(member['member_id'], new_renewal.strftime("%Y-%m-%d"))
-                db.add_renewal_record(member['member_id'], new_renewal.strftime("%Y-%m-%d"), current_renewal.strftime("%Y-%m-%d"))
+                db.renew_members([member['member_id']], relativedelta(years=1))
                 st.success(f"Membership renewed! New expiry: {new_renewal.strftime('%B %d, %Y')}")
                 st.rerun()
 
@@ -354,17 +675,33 @@ def display_manage_members():
                 new_pic = st.file_uploader("Update Profile Picture", type=['png', 'jpg', 'jpeg'])
                 if st.form_submit_button("Save Changes"):
                     updated_data = {"name": new_name, "dob": new_dob.strftime("%Y-%m-%d"), "email": new_email, "phone": new_phone,
-                                    "address": new_address, "department": new_dept, "profile_pic": new_pic.read() if new_pic else member['profile_pic']}
-                    db.update_member(member['member_id'], updated_data)
-                    st.success("Member details updated successfully!")
-                    st.rerun()
+                                    "address": new_address, "department": new_dept}
+                    photo_error = None
+                    if new_pic:
+                        try:
+                            updated_data["profile_pic"], updated_data["profile_pic_thumbnail"] = photos.process_profile_pic(new_pic.read())
+                        except ValueError as e:
+                            photo_error = e
+                    if photo_error:
+                        st.error(f"Could not read the profile picture: {photo_error}")
+                    else:
+                        db.update_member(member['member_id'], updated_data)
+                        st.success("Member details updated successfully!")
+                        st.rerun()
 
         with tab3:
-            history = db.get_renewal_history(member['member_id'])
-            if not history:
+            total_renewals = db.count_renewal_history(member['member_id'])
+            if not total_renewals:
                 st.info("No renewal history found for this member.")
             else:
-                for i, record in enumerate(history):
+                page_count = -(-total_renewals // HISTORY_PAGE_SIZE)
+                history_page = 0
+                if page_count > 1:
+                    history_page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1,
+                                                   key=f"history_page_{member['member_id']}") - 1
+                history = db.get_renewal_history(member['member_id'], limit=HISTORY_PAGE_SIZE,
+                                                 offset=history_page * HISTORY_PAGE_SIZE)
+                for i, record in enumerate(history, start=history_page * HISTORY_PAGE_SIZE):
                     renewed_to = datetime.strptime(record['renewal_date'], '%Y-%m-%d').date()
                     renewed_from = datetime.strptime(record['previous_renewal_date'], '%Y-%m-%d').date()
                     st.markdown(f"**Renewed from** `{renewed_from.strftime('%b %d, %Y')}` **to** `{renewed_to.strftime('%b %d, %Y')}`")
@@ -380,10 +717,75 @@ def display_manage_members():
             if st.checkbox(f"I confirm I want to delete {member['name']}", key=f"delete_confirm_{member['member_id']}"):
                 if st.button("DELETE PERMANENTLY", type="primary"):
                     db.delete_member(member['member_id'])
+                    qr_cache.invalidate(member['member_id'])
                     st.success(f"Member {member['name']} has been deleted.")
                     st.session_state.selected_member_id = None
                     st.rerun()
 
+def display_diagnostics():
+    import attendance
+    import photos
+    st.title("🩺 Diagnostics")
+    st.markdown("---")
+
+    snapshot = diagnostics.snapshot()
+    cache_stats = db.get_read_cache_stats()
+    pool_stats = db.get_pool_stats()
+    if not snapshot["enabled"]:
+        st.warning("Instrumentation is disabled (MEMBERS_DIAGNOSTICS=0).")
+
+    counters = snapshot["counters"]
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("SQLite Statements", counters.get("sqlite.statements", 0) if snapshot["trace_statements"] else "off",
+                help=None if snapshot["trace_statements"] else "Set MEMBERS_DIAGNOSTICS_TRACE=1 to count every statement.")
+    col2.metric("Lock Errors", counters.get("sqlite.lock_errors", 0))
+    col3.metric("Read Cache Hits / Misses", f"{cache_stats['hits']} / {cache_stats['misses']}")
+    col4.metric("Scanner Frames (dropped)", f"{counters.get('scanner.frames_seen', 0)} ({counters.get('scanner.frames_dropped', 0)})")
+
+    timings = pd.DataFrame(snapshot["timings"], columns=["category", "name", "count", "total_ms", "avg_ms", "max_ms", "last_ms", "rows"])
+    for category, title in [("page", "Page Renders"), ("query", "SQL Queries"),
+                            ("qr", "QR Codes"), ("photo", "Photo Processing"), ("dataframe", "DataFrame Construction"),
+                            ("scanner", "Scanner Decodes"), ("job", "Background Jobs"), ("attendance", "Attendance Writes"),
+                            ("sync", "Replication"), ("startup", "Startup")]:
+        st.subheader(title)
+        rows = timings[timings["category"] == category].drop(columns="category")
+        if rows.empty:
+            st.info("Nothing recorded yet.")
+        else:
+            st.dataframe(rows.round(2), use_container_width=True, hide_index=True)
+
+    st.subheader("Job Schedule")
+    st.dataframe(pd.DataFrame(scheduler.scheduler.get_status()), use_container_width=True, hide_index=True)
+
+    with st.expander("Counters, read cache and connection pool"):
+        st.json({"counters": counters, "read_cache": cache_stats, "pool": pool_stats,
+                 "attendance_writer": attendance.writer.get_stats()})
+    with st.expander("Recent events (structured log)"):
+        st.dataframe(pd.DataFrame(snapshot["recent_events"]), use_container_width=True, hide_index=True)
+
+    with st.expander("Maintenance"):
+        status = photos.optimize_status
+        st.markdown("Re-encode photos stored before the ingestion pipeline existed (resize, thumbnail). "
+                    "Runs on a background thread.")
+        if st.button("Optimize Stored Photos", disabled=status["running"]):
+            photos.start_optimizing_stored_photos()
+            st.rerun()
+        if status["running"] or status["processed"] or status["failed"]:
+            state = "running" if status["running"] else "finished"
+            st.caption(f"Photo optimization {state}: {status['processed']} processed, {status['failed']} unreadable.")
+        if status["error"]:
+            st.error(f"Photo optimization stopped: {status['error']}")
+
+    export_col, reset_col = st.columns(2)
+    export_col.download_button("Download Diagnostics (JSON)",
+                               data=lambda: diagnostics.export_json(read_cache=db.get_read_cache_stats(), pool=db.get_pool_stats(),
+                                                                    jobs=scheduler.scheduler.get_status(),
+                                                                    attendance_writer=attendance.writer.get_stats()),
+                               file_name=f"diagnostics_{datetime.now():%Y%m%d_%H%M%S}.json", mime="application/json")
+    if reset_col.button("Reset Counters"):
+        diagnostics.reset()
+        st.rerun()
+
 def display_manage_departments():
     st.title("🏢 Manage Departments")
     st.markdown("---")
@@ -413,6 +815,7 @@ def display_manage_departments():
 # --- App Entry Point ---
 if __name__ == "__main__":
     db.init_db()  # Ensure database and tables exist on first run
+    scheduler.start()  # Background snapshots and database maintenance (once per process)
     
     if "logged_in" not in st.session_state:
         st.session_state["logged_in"] = False
@@ -0,0 +1,142 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import date, datetime
+import database as db
+import diagnostics
+from scanner import ScanDeduplicator
+
+logger = logging.getLogger("members.attendance")
+
+# --- Configuration ---
+# Buffered check-ins are written when this many are waiting, or after FLUSH_INTERVAL seconds
+FLUSH_BATCH_SIZE = int(os.environ.get("ATTENDANCE_BATCH_SIZE", "200"))
+FLUSH_INTERVAL = float(os.environ.get("ATTENDANCE_FLUSH_SECONDS", "1.0"))
+# A member standing in front of the kiosk is only checked in once per this many seconds
+KIOSK_COOLDOWN = float(os.environ.get("KIOSK_DEDUP_SECONDS", "30"))
+
+class AttendanceWriter:
+    """
+    Buffers check-ins in memory and writes them to the attendance table in batches
+    from a background thread, so the scanner never waits on a commit. If a batch
+    fails (e.g. the database is locked) it is kept and retried on the next flush.
+    """
+    def __init__(self, batch_size=FLUSH_BATCH_SIZE, interval=FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = queue.Queue()
+        self._pending = []  # taken from the queue but not yet written; guarded by _flush_lock
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._batch_ready = threading.Event()
+        self._thread = None
+        self._stats = {"written": 0, "batches": 0, "failed_flushes": 0, "last_flush_ms": 0.0}
+
+    def record(self, member_id, status, station=None, checked_in_at=None):
+        """Queues one check-in. Never touches the database."""
+        checked_in_at = checked_in_at or datetime.now().isoformat(timespec="seconds")
+        self._queue.put((member_id, checked_in_at, status, station))
+        if self._queue.qsize() >= self.batch_size:
+            self._batch_ready.set()
+        self._ensure_started()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="attendance-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        # Flush every interval, or as soon as a full batch is waiting
+        while True:
+            self._batch_ready.wait(self.interval)
+            self._batch_ready.clear()
+            self.flush()
+
+    def flush(self):
+        """Writes everything buffered so far. Returns the number of rows written."""
+        with self._flush_lock:
+            while True:
+                try:
+                    self._pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not self._pending:
+                return 0
+            batch = self._pending
+            start = time.perf_counter()
+            try:
+                db.add_attendance_records(batch)
+            except Exception:
+                self._stats["failed_flushes"] += 1
+                diagnostics.increment("attendance.failed_flushes")
+                logger.exception("Writing %d check-ins failed; will retry", len(batch))
+                return 0
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._pending = []
+            self._stats["written"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["last_flush_ms"] = elapsed_ms
+            diagnostics.record("attendance", "flush", elapsed_ms, rows=len(batch))
+            return len(batch)
+
+    def get_stats(self):
+        """Returns written/batch/failure counters and how many check-ins are still buffered."""
+        with self._flush_lock:
+            return {**self._stats, "buffered": len(self._pending) + self._queue.qsize()}
+
+# Shared by every kiosk in this process; whatever is still buffered is written at exit
+writer = AttendanceWriter()
+atexit.register(writer.flush)
+
+# --- Kiosk Check-In ---
+# The outcome of one scan: status is "valid", "expired", "unknown" (a MEM- ID that isn't
+# a member) or "invalid" (not a member QR code). recorded is False for repeat scans.
+CheckIn = namedtuple("CheckIn", ["member_id", "name", "status", "next_renewal_date", "recorded", "at"])
+
+class KioskStation:
+    """
+    Turns decoded QR codes into check-ins for one kiosk: looks the member up (in-memory
+    ID index first, then the shared read cache), decides valid/expired, and queues an
+    attendance row at most once per member per cooldown.
+    """
+    def __init__(self, station=None, cooldown=KIOSK_COOLDOWN, attendance_writer=writer, history=20):
+        self.station = station
+        self.writer = attendance_writer
+        self._dedup = ScanDeduplicator(cooldown)
+        self._lock = threading.Lock()
+        self._last = {}
+        self.recent = deque(maxlen=history)
+        self.check_ins = 0
+
+    def check_in(self, data, today=None):
+        if not data.startswith("MEM-"):
+            return CheckIn(data, None, "invalid", None, False, datetime.now())
+        if data not in db.member_ids:
+            return CheckIn(data, None, "unknown", None, False, datetime.now())
+
+        if not self._dedup.accept(data):
+            # Already checked in recently: show the same result again without recording it
+            with self._lock:
+                last = self._last.get(data)
+            return last._replace(recorded=False) if last else CheckIn(data, None, "unknown", None, False, datetime.now())
+
+        member = db.get_member_by_id(data)
+        if member is None:
+            return CheckIn(data, None, "unknown", None, False, datetime.now())
+        today = (today or date.today()).isoformat()
+        status = "valid" if member['next_renewal_date'] >= today else "expired"
+        result = CheckIn(data, member['name'], status, member['next_renewal_date'], True, datetime.now())
+        self.writer.record(data, status, self.station, result.at.isoformat(timespec="seconds"))
+        with self._lock:
+            self._last[data] = result
+            self.recent.appendleft(result)
+            self.check_ins += 1
+        diagnostics.increment(f"attendance.{status}")
+        return result
@@ -0,0 +1,423 @@
+"""
+Benchmarks the database layer and the data-preparation work behind the app's pages
+against a temporary, synthetically filled members.db.
+
+Usage:
+    python benchmark.py --sizes 10000 100000 1000000 --output bench.json
+    python benchmark.py --sizes 10000 --frames-dir recorded_frames/
+    python benchmark.py --sizes 1000 --skip-scanner --startup-runs 5
+
+Results are written as JSON so runs from different versions can be compared.
+"""
+import argparse
+import functools
+import glob
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+from PIL import Image
+import database as db
+import export
+import member_analytics
+import scheduler
+from qr_codes import QRCodeCache, render_qr_code
+from scanner import ScanChannel, ScanDeduplicator, QRScanner
+
+FIRST_NAMES = ["Ada", "Ben", "Chloe", "Dev", "Elena", "Femi", "Grace", "Hiro", "Ines", "Jon", "Kemi", "Liam"]
+LAST_NAMES = ["Okafor", "Smith", "Garcia", "Chen", "Ivanova", "Khan", "Muller", "Rossi", "Sato", "Nakamura"]
+DEPARTMENTS = ['Tech', 'Literature', 'HR', 'Finance', 'Admin']
+
+# --- Synthetic Data ---
+def make_photos(count, size=(320, 320)):
+    """Generates `count` distinct small JPEG photos (noise, so they don't compress away)."""
+    rng = np.random.default_rng(0)
+    photos = []
+    for _ in range(count):
+        pixels = rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+        buf = io.BytesIO()
+        Image.fromarray(pixels).save(buf, format="JPEG", quality=80)
+        photos.append(buf.getvalue())
+    return photos
+
+def synthetic_members(count, photo_fraction, photos, seed=0):
+    """Yields member dicts with plausible names, dates and departments."""
+    rng = random.Random(seed)
+    today = date.today()
+    for i in range(count):
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}"
+        member_since = today - timedelta(days=rng.randint(0, 5 * 365))
+        yield {
+            "member_id": f"MEM-{i:08X}",
+            "name": name,
+            "dob": (today - timedelta(days=rng.randint(18 * 365, 80 * 365))).isoformat(),
+            "email": f"{name.lower().replace(' ', '.')}@example.org",
+            "phone": f"+1555{i:07d}",
+            "address": f"{rng.randint(1, 999)} Main Street",
+            "department": rng.choice(DEPARTMENTS),
+            "member_since": member_since.isoformat(),
+            "next_renewal_date": (member_since + relativedelta(years=1) + timedelta(days=rng.randint(-400, 400))).isoformat(),
+            "profile_pic": rng.choice(photos) if photos and rng.random() < photo_fraction else None,
+        }
+
+def seed_database(path, size, photo_fraction, renewals_per_member, distinct_photos):
+    """Creates and fills a members.db at `path`. Returns seeding timings."""
+    db.configure(db_path=path)
+    db.init_db()
+    timings = {}
+    photos = make_photos(distinct_photos) if photo_fraction > 0 else []
+
+    start = time.perf_counter()
+    db.add_members(synthetic_members(size, photo_fraction, photos), chunk_size=10000)
+    timings["insert_members_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    member_ids = [f"MEM-{i:08X}" for i in range(size)]
+    for _ in range(renewals_per_member):
+        db.renew_members(member_ids, notes="benchmark seed")
+    timings["seed_renewals_s"] = time.perf_counter() - start
+    return timings
+
+# --- Timing ---
+def time_call(func, repeat, setup=None):
+    """Runs func `repeat` times (after optional setup each time) and returns timing stats in ms."""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        result = func()
+        samples.append((time.perf_counter() - start) * 1000)
+    stats = {
+        "min_ms": min(samples),
+        "median_ms": statistics.median(samples),
+        "mean_ms": statistics.fmean(samples),
+        "max_ms": max(samples),
+        "runs": repeat,
+    }
+    if isinstance(result, (list, tuple)):
+        stats["rows"] = len(result)
+    return stats
+
+def run_cases(cases, repeat, cold=True):
+    """Times each (name, func) case. Cold runs clear the read cache before every call."""
+    results = {}
+    for name, func in cases:
+        results[name] = time_call(func, repeat, setup=db.clear_read_cache if cold else None)
+    return results
+
+# --- Database Cases ---
+def database_cases(size):
+    sample_id = f"MEM-{size // 2:08X}"
+    today = date.today()
+
+    def write_cycle():
+        # add -> update -> renew -> revert -> delete on a throwaway member
+        member = next(synthetic_members(1, 0, [], seed=random.random()))
+        member["member_id"] = "MEM-BENCH000"
+        db.add_member(member)
+        db.update_member(member["member_id"], {**member, "name": "Bench Updated"})
+        db.renew_members([member["member_id"]])
+        last = db.get_renewal_history(member["member_id"])[0]
+        db.revert_last_renewal(last["id"], member["member_id"], last["previous_renewal_date"])
+        db.delete_member(member["member_id"])
+
+    def department_cycle():
+        db.add_department("Benchmark Dept")
+        db.delete_department("Benchmark Dept")
+
+    def drain(chunks):
+        return sum(len(rows) for rows in chunks)
+
+    def check_ins(count):
+        now = datetime.now().isoformat(timespec="seconds")
+        return [(sample_id, now, "valid", "benchmark") for _ in range(count)]
+
+    def attendance_row_by_row():
+        # What the kiosk would cost if every scan committed its own row
+        for row in check_ins(200):
+            db.add_attendance_records([row])
+
+    return [
+        ("get_all_members", db.get_all_members),
+        ("get_dashboard_stats", lambda: db.get_dashboard_stats(today)),
+        ("get_recent_members", lambda: db.get_recent_members(limit=5)),
+        ("get_member_by_id", lambda: db.get_member_by_id(sample_id)),
+        ("get_profile_pic", lambda: db.get_profile_pic(db.get_member_by_id(sample_id)["profile_pic_hash"])),
+        ("search_members_prefix", lambda: db.search_members("Grace", limit=50)),
+        ("search_members_substring", lambda: db.search_members("race okaf", limit=50)),
+        ("search_members_short", lambda: db.search_members("Ad", limit=50)),
+        ("count_search_results", lambda: db.count_search_results("Grace")),
+        ("get_all_departments", db.get_all_departments),
+        ("get_renewal_history", lambda: db.get_renewal_history(sample_id)),
+        ("get_renewal_summary", lambda: db.get_renewal_summary(start_month=f"{today.year - 1}-{today.month:02d}")),
+        ("get_member_ids_for_renewal_department", lambda: db.get_member_ids_for_renewal(department="Tech")),
+        ("get_member_ids_for_renewal_window", lambda: db.get_member_ids_for_renewal(
+            expiring_from=today, expiring_until=today + timedelta(days=30))),
+        ("iter_members_all", lambda: drain(db.iter_members())),
+        ("iter_renewal_history_all", lambda: drain(db.iter_renewal_history())),
+        ("export_members_csv", lambda: export.export_members("csv").close()),
+        ("export_members_parquet", lambda: export.export_members("parquet").close()),
+        ("write_cycle_add_update_renew_revert_delete", write_cycle),
+        ("department_add_delete", department_cycle),
+        ("attendance_batch_200", lambda: db.add_attendance_records(check_ins(200))),
+        ("attendance_row_by_row_200", attendance_row_by_row),
+        ("count_attendance_today", lambda: db.count_attendance(today)),
+        ("export_changes_last_1000", lambda: db.export_changes(max(0, db.get_change_log_position() - 1000))),
+    ]
+
+# --- Page Data-Preparation Cases ---
+def page_cases(size):
+    sample_id = f"MEM-{size // 2:08X}"
+    today = date.today()
+    qr_memory_only = QRCodeCache(persist=False)
+
+    def dashboard():
+        # What display_dashboard reads once the scheduler has written its snapshots
+        snapshots = [db.get_snapshot(name) for name in ("dashboard_stats", "upcoming_expiries", "department_totals")]
+        df = pd.DataFrame([dict(row) for row in db.get_recent_members(limit=5)])
+        trend = pd.DataFrame([dict(row) for row in db.get_renewal_summary(start_month=f"{today.year - 1}-{today.month:02d}")])
+        return snapshots, df, trend
+
+    def manage_members_list(query):
+        total = db.count_search_results(query)
+        page = db.search_members(query, limit=50)
+        options = {f"{m['name']} ({m['member_id']})": m['member_id'] for m in page}
+        return total, options
+
+    def legacy_python_search():
+        # The pre-FTS approach: load everyone and filter labels in Python
+        members = db.get_all_members()
+        labels = {f"{m['name']} ({m['member_id']})": m['member_id'] for m in members}
+        return [k for k in labels if "grace" in k.lower()]
+
+    def member_detail():
+        member = db.get_member_by_id(sample_id)
+        dob = datetime.strptime(member['dob'], "%Y-%m-%d").date()
+        photo = db.get_profile_pic(member['profile_pic_hash'])
+        history = db.get_renewal_history(member['member_id'], limit=10)
+        return dob, photo, history
+
+    def department_breakdown():
+        frame = db.get_members_frame(columns=('department', 'dob', 'next_renewal_date'))
+        return member_analytics.department_summary(frame, today)
+
+    return [
+        ("job_dashboard_snapshot", scheduler.refresh_dashboard_snapshot),
+        ("job_expiry_snapshot", scheduler.refresh_expiry_snapshot),
+        ("job_department_snapshot", scheduler.refresh_department_snapshot),
+        ("job_pragma_optimize", db.optimize_database),
+        ("job_analyze", lambda: db.optimize_database(analyze=True)),
+        ("dashboard", dashboard),
+        ("dashboard_department_breakdown", department_breakdown),
+        ("manage_members_list_empty_query", lambda: manage_members_list("")),
+        ("manage_members_list_search", lambda: manage_members_list("grace")),
+        ("legacy_python_search_filter", legacy_python_search),
+        ("member_detail", member_detail),
+        ("qr_render_uncached", lambda: render_qr_code(sample_id)),
+        ("qr_cached_memory", lambda: qr_memory_only.get(sample_id)),
+    ]
+
+# --- Scanner ---
+def load_frames(frames_dir, count, member_ids=("MEM-000001F4",)):
+    """
+    Loads recorded frames (images or .npy arrays) or synthesizes 720p frames with a moving
+    QR code, showing each of member_ids in turn for ten frames.
+    """
+    if frames_dir:
+        frames = []
+        for path in sorted(glob.glob(os.path.join(frames_dir, "*"))):
+            if path.endswith(".npy"):
+                frames.append(np.load(path))
+            elif path.lower().endswith((".png", ".jpg", ".jpeg", ".bmp")):
+                frames.append(np.array(Image.open(path).convert("RGB"))[:, :, ::-1].copy())
+        if not frames:
+            raise SystemExit(f"No frames found in {frames_dir}")
+        return frames
+
+    codes = [np.array(Image.open(io.BytesIO(render_qr_code(member_id, box_size=6))).convert("RGB"))[:, :, ::-1]
+             for member_id in member_ids]
+    frames = []
+    for i in range(count):
+        frame = np.full((720, 1280, 3), 180, np.uint8)
+        qr = codes[(i // 10) % len(codes)]
+        if i % 10 < 8:  # a code is visible in 80% of frames
+            x, y = 200 + (i * 7) % 600, 100 + (i * 3) % 300
+            frame[y:y + qr.shape[0], x:x + qr.shape[1]] = qr
+        frames.append(frame)
+    return frames
+
+def benchmark_scanner(frames):
+    """Runs the app's video_frame_callback over frames and reports per-frame timing and scanner stats."""
+    import av
+    from app import kiosk_frame_callback, video_frame_callback
+    from attendance import AttendanceWriter, KioskStation
+
+    # The callback checks decoded IDs against the in-memory member ID index; give it a
+    # small database of its own (the size databases are gone by now) and load the index up front.
+    workdir = tempfile.mkdtemp(prefix="members_bench_scanner_")
+    seed_database(os.path.join(workdir, "members.db"), 1000, 0, 0, 0)
+    db.member_ids.load()
+
+    # The kiosk callback looks the member up and queues a check-in; cooldown 0 records every scan
+    writer = AttendanceWriter()
+    kiosk = functools.partial(kiosk_frame_callback, station=KioskStation("benchmark", cooldown=0, attendance_writer=writer),
+                              channel=ScanChannel(), dedup=ScanDeduplicator())
+    lookup = functools.partial(video_frame_callback, channel=ScanChannel(), dedup=ScanDeduplicator())
+
+    results = {}
+    for label, callback, scanner in [("stride_1", lookup, QRScanner(frame_stride=1)), ("stride_2", lookup, QRScanner(frame_stride=2)),
+                                     ("full_resolution", lookup, QRScanner(max_width=10_000, frame_stride=1)),
+                                     ("kiosk_stride_2", kiosk, QRScanner(frame_stride=2))]:
+        av_frames = [av.VideoFrame.from_ndarray(f, format="bgr24") for f in frames]
+        samples = []
+        for frame in av_frames:
+            start = time.perf_counter()
+            callback(frame, scanner=scanner)
+            samples.append((time.perf_counter() - start) * 1000)
+        samples.sort()
+        results[label] = {
+            "frames": len(samples),
+            "median_ms": statistics.median(samples),
+            "p95_ms": samples[int(len(samples) * 0.95) - 1],
+            "mean_ms": statistics.fmean(samples),
+            "scanner": scanner.get_stats(),
+        }
+    writer.flush()
+    results["kiosk_stride_2"]["attendance_writer"] = writer.get_stats()
+    db.close_all_connections()
+    shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+# --- Cold Start ---
+# Run in a fresh interpreter per sample, so nothing is imported or initialized yet.
+# Prints one JSON object: time to import AppTest (i.e. Streamlit), the first login-page
+# run, a rerun, the first dashboard run, and which heavy modules got imported on the way.
+STARTUP_SCRIPT = r"""
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+result = {"import_streamlit_ms": (time.perf_counter() - start) * 1000}
+at = AppTest.from_file(sys.argv[1], default_timeout=120)
+for label in ("login_first_run_ms", "login_rerun_ms"):
+    start = time.perf_counter(); at.run(); result[label] = (time.perf_counter() - start) * 1000
+result["heavy_modules_after_login"] = sorted(m for m in HEAVY_MODULES if m in sys.modules)
+at.session_state["logged_in"] = True
+start = time.perf_counter(); at.run(); result["dashboard_first_run_ms"] = (time.perf_counter() - start) * 1000
+start = time.perf_counter(); at.run(); result["dashboard_rerun_ms"] = (time.perf_counter() - start) * 1000
+result["heavy_modules_after_dashboard"] = sorted(m for m in HEAVY_MODULES if m in sys.modules)
+result["exceptions"] = [e.message for e in at.exception]
+print(json.dumps(result))
+"""
+HEAVY_MODULES = ["cv2", "streamlit_webrtc", "av", "qrcode", "PIL.Image", "pyarrow", "openpyxl", "pandas", "numpy"]
+
+def benchmark_startup(runs, size=1000):
+    """Times cold starts of app.py (login page, then dashboard) in fresh subprocesses."""
+    workdir = tempfile.mkdtemp(prefix="members_bench_startup_")
+    path = os.path.join(workdir, "members.db")
+    seed_database(path, size, 0, 1, 0)
+    db.close_all_connections()
+    env = {**os.environ, "MEMBERS_DB_PATH": path, "SCHEDULER_ENABLED": "0"}
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    script = STARTUP_SCRIPT.replace("HEAVY_MODULES", repr(HEAVY_MODULES))
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", script, app_path], env=env, capture_output=True,
+                                text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    shutil.rmtree(workdir, ignore_errors=True)
+    timing_keys = [k for k in samples[0] if k.endswith("_ms")]
+    return {
+        "runs": runs,
+        "median_ms": {k: statistics.median(s[k] for s in samples) for k in timing_keys},
+        "heavy_modules_after_login": samples[0]["heavy_modules_after_login"],
+        "heavy_modules_after_dashboard": samples[0]["heavy_modules_after_dashboard"],
+        "exceptions": samples[0]["exceptions"],
+    }
+
+# --- Entry Point ---
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--photo-fraction", type=float, default=0.3, help="share of members with a photo")
+    parser.add_argument("--distinct-photos", type=int, default=200)
+    parser.add_argument("--renewals-per-member", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--frames-dir", help="directory of recorded frames (.png/.jpg/.npy)")
+    parser.add_argument("--frame-count", type=int, default=120, help="synthetic frames if --frames-dir is not given")
+    parser.add_argument("--skip-scanner", action="store_true")
+    parser.add_argument("--startup-runs", type=int, default=3, help="cold-start samples (0 to skip)")
+    parser.add_argument("--keep-db", action="store_true", help="don't delete the temporary databases")
+    parser.add_argument("--output", default="bench_output.json")
+    args = parser.parse_args(argv)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": sys.version.split()[0],
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "sizes": {},
+    }
+
+    for size in args.sizes:
+        workdir = tempfile.mkdtemp(prefix=f"members_bench_{size}_")
+        path = os.path.join(workdir, "members.db")
+        print(f"Seeding {size:,} members into {path} ...", flush=True)
+        seed_timings = seed_database(path, size, args.photo_fraction, args.renewals_per_member, args.distinct_photos)
+        entry = {
+            "seed": seed_timings,
+            "db_size_bytes": os.path.getsize(path),
+            "database": run_cases(database_cases(size), args.repeat, cold=True),
+            "database_cached": run_cases(database_cases(size)[:14], args.repeat, cold=False),
+            "pages": run_cases(page_cases(size), args.repeat, cold=True),
+        }
+        report["sizes"][str(size)] = entry
+        for section in ("database", "pages"):
+            for name, stats in entry[section].items():
+                print(f"  {section:9} {name:45} {stats['median_ms']:10.2f} ms")
+
+        db.close_all_connections()
+        if not args.keep_db:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if not args.skip_scanner:
+        report["scanner"] = benchmark_scanner(load_frames(args.frames_dir, args.frame_count))
+        for label, stats in report["scanner"].items():
+            print(f"  scanner   {label:45} {stats['median_ms']:10.2f} ms/frame")
+
+    if args.startup_runs:
+        report["startup"] = benchmark_startup(args.startup_runs)
+        for name, value in report["startup"]["median_ms"].items():
+            print(f"  startup   {name:45} {value:10.2f} ms")
+        print(f"  startup   heavy modules after login: {', '.join(report['startup']['heavy_modules_after_login']) or 'none'}")
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+if __name__ == "__main__":
+    main()
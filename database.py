@@ -1,17 +1,459 @@
 import sqlite3
-from datetime import date
+from datetime import date, datetime, timedelta
 import io
+import os
+import hashlib
+import queue
+import threading
+import atexit
+import functools
+import time
+import json
+import re
+import bisect
+from array import array
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
+from dateutil.relativedelta import relativedelta
+import diagnostics
 
-def get_db_connection():
-    """Establishes a connection to the SQLite database."""
-    conn = sqlite3.connect('members.db')
+# --- Connection Configuration ---
+# The database path and pragmas can be overridden through the environment or
+# at runtime with configure(). Every function in this module goes through
+# get_db_connection(), so they all pick up the same settings.
+DB_PATH = os.environ.get("MEMBERS_DB_PATH", "members.db")
+POOL_SIZE = int(os.environ.get("MEMBERS_DB_POOL_SIZE", "8"))
+PRAGMAS = {
+    "journal_mode": os.environ.get("MEMBERS_DB_JOURNAL_MODE", "WAL"),
+    "synchronous": os.environ.get("MEMBERS_DB_SYNCHRONOUS", "NORMAL"),
+    "cache_size": int(os.environ.get("MEMBERS_DB_CACHE_SIZE", "-20000")),  # negative = KiB (~20 MB)
+    "mmap_size": int(os.environ.get("MEMBERS_DB_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "busy_timeout": int(os.environ.get("MEMBERS_DB_BUSY_TIMEOUT", "5000")),  # milliseconds
+    "temp_store": "MEMORY",
+}
+
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_pool_lock = threading.Lock()
+_pool_generation = 0
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that reports statement timing and fetched row counts to diagnostics."""
+    _diag_sql = None
+
+    def execute(self, sql, parameters=()):
+        return self._timed_execute(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed_execute(super().executemany, sql, seq_of_parameters)
+
+    def _timed_execute(self, execute, sql, parameters):
+        """Runs execute(sql, parameters), recording wall-clock time, row count and lock errors."""
+        start = time.perf_counter()
+        try:
+            execute(sql, parameters)
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e) or "busy" in str(e):
+                diagnostics.increment("sqlite.lock_errors")
+            raise
+        diagnostics.record_query(sql, (time.perf_counter() - start) * 1000, self.rowcount)
+        self._diag_sql = sql
+        return self
+
+    def _timed_fetch(self, fetch, *args):
+        start = time.perf_counter()
+        result = fetch(*args)
+        if self._diag_sql is not None:
+            rows = len(result) if isinstance(result, list) else int(result is not None)
+            diagnostics.record_fetch(self._diag_sql, (time.perf_counter() - start) * 1000, rows)
+        return result
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+class PooledConnection(sqlite3.Connection):
+    """
+    A sqlite3 connection that goes back to the pool when closed.
+    Callers keep using the usual `conn = get_db_connection() ... conn.close()`
+    pattern; close() rolls back anything left uncommitted and hands the
+    connection to the next caller instead of tearing it down.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._generation = _pool_generation
+        self._checked_out = False
+
+    def close(self):
+        if not self._checked_out:
+            return
+        self._checked_out = False
+        if self.in_transaction:
+            self.rollback()
+        if self._generation != _pool_generation:
+            self.discard()
+            return
+        try:
+            _pool.put_nowait(self)
+        except queue.Full:
+            self.discard()
+
+    def discard(self):
+        """Closes the underlying SQLite handle for good."""
+        self._checked_out = False
+        super().close()
+
+    # Route statements through InstrumentedCursor for the diagnostics page (see diagnostics.py)
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def _open_connection():
+    conn = sqlite3.connect(DB_PATH, factory=PooledConnection, check_same_thread=False,
+                           timeout=PRAGMAS["busy_timeout"] / 1000)
     conn.row_factory = sqlite3.Row
+    for pragma, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    if diagnostics.TRACE_STATEMENTS:
+        conn.set_trace_callback(diagnostics.trace_statement)
+    diagnostics.increment("db.connections_opened")
     return conn
 
-def init_db():
-    """Initializes the database and creates tables if they don't exist."""
+def get_db_connection():
+    """Returns a pooled connection to the SQLite database (WAL mode, tuned pragmas)."""
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = _open_connection()
+    conn._checked_out = True
+    diagnostics.increment("db.checkouts")
+    return conn
+
+def get_pool_stats():
+    return {"db_path": DB_PATH, "pool_size": POOL_SIZE, "idle_connections": _pool.qsize()}
+
+def close_all_connections():
+    """Closes every idle pooled connection. Checked-out connections are closed when returned."""
+    global _pool_generation
+    with _pool_lock:
+        _pool_generation += 1
+        while True:
+            try:
+                _pool.get_nowait().discard()
+            except queue.Empty:
+                break
+
+def configure(db_path=None, pool_size=None, **pragmas):
+    """
+    Changes the database path, pool size and/or pragmas (e.g. synchronous="FULL",
+    mmap_size=0). Existing pooled connections are dropped so new settings apply.
+    """
+    global DB_PATH, POOL_SIZE, _pool
+    close_all_connections()
+    with _pool_lock:
+        if db_path is not None:
+            DB_PATH = db_path
+            _schema_ready.discard(db_path)  # the file may have been replaced
+        if pool_size is not None:
+            POOL_SIZE = pool_size
+            _pool = queue.LifoQueue(maxsize=POOL_SIZE)
+        PRAGMAS.update(pragmas)
+    global _seen_change_log_position
+    _seen_change_log_position = None
+    bump_data_version()
+    member_ids.reset()
+
+atexit.register(close_all_connections)
+
+# Keys per IN (...) list, well below SQLite's bound-parameter limit
+IN_CHUNK_SIZE = 500
+
+def _select_in(conn, select, column, values, chunk_size=IN_CHUNK_SIZE):
+    """Runs `select WHERE column IN (...)` over values in chunks and yields every row."""
+    values = list(values)
+    for start in range(0, len(values), chunk_size):
+        chunk = values[start:start + chunk_size]
+        yield from conn.execute(f'{select} WHERE {column} IN ({", ".join("?" * len(chunk))})', chunk)
+
+# --- Read Cache ---
+# Results of read functions are shared by every session in this process. Each entry is
+# tied to the data version it was read at; every write function bumps the version, which
+# invalidates all cached reads at once. Writes made by other processes (an import or
+# `replication.py apply` run from the command line) are noticed by polling the change
+# log position, at most every EXTERNAL_CHANGE_CHECK_SECONDS.
+READ_CACHE_SIZE = int(os.environ.get("MEMBERS_READ_CACHE_SIZE", "512"))
+EXTERNAL_CHANGE_CHECK_SECONDS = float(os.environ.get("MEMBERS_EXTERNAL_CHANGE_CHECK_SECONDS", "1.0"))
+
+_read_cache = OrderedDict()
+_read_cache_lock = threading.Lock()
+_read_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+_data_version = 0
+_external_check_lock = threading.Lock()
+_external_checked_at = 0.0
+_seen_change_log_position = None
+
+def _current_change_log_position():
     conn = get_db_connection()
+    try:
+        return _change_log_position(conn)
+    except sqlite3.OperationalError:
+        return None  # no schema yet
+    finally:
+        conn.close()
+
+def check_external_changes():
+    """
+    Bumps the data version when the change log has moved past what this process has
+    seen, and applies added and deleted member IDs to the member ID index. Only the
+    replicated tables are logged, so attendance and snapshot writes don't invalidate
+    anything; this process's own writes are skipped by writes_data.
+    """
+    global _external_checked_at, _seen_change_log_position
+    if time.monotonic() - _external_checked_at < EXTERNAL_CHANGE_CHECK_SECONDS:
+        return
+    if not _external_check_lock.acquire(blocking=False):
+        return  # another thread is checking
+    try:
+        _external_checked_at = time.monotonic()
+        conn = get_db_connection()
+        try:
+            position = _change_log_position(conn)
+            seen = _seen_change_log_position
+            member_changes = {}
+            if seen is not None and seen < position:
+                for key, op in conn.execute("SELECT row_key, op FROM change_log WHERE seq > ? AND table_name = 'members' "
+                                            "ORDER BY seq", (seen,)):
+                    member_changes[key] = op  # the last change to each ID wins
+        except sqlite3.OperationalError:
+            return  # no schema yet
+        finally:
+            conn.close()
+        _seen_change_log_position = position
+        if seen is None or position == seen:
+            return
+        diagnostics.increment("db.external_changes")
+        bump_data_version()
+        if position < seen:
+            member_ids.reset()  # a different database file (or log) than before
+            return
+        member_ids.add([key for key, op in member_changes.items() if op == "upsert"])
+        for key, op in member_changes.items():
+            if op == "delete":
+                member_ids.discard(key)
+    finally:
+        _external_check_lock.release()
+
+def get_data_version():
+    check_external_changes()
+    return _data_version
+
+def bump_data_version():
+    """Marks the data as changed, invalidating every cached read."""
+    global _data_version
+    with _read_cache_lock:
+        _data_version += 1
+        if _read_cache:
+            _read_cache.clear()
+            _read_cache_stats["invalidations"] += 1
+
+def _cache_key_part(value):
+    # Lists (e.g. a column list) are unhashable; they key the same as the equal tuple
+    return tuple(value) if isinstance(value, list) else value
+
+def cached_read(func):
+    """Serves repeated calls with the same arguments from the read cache until the next write (or midnight)."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Keyed by the current date too: reads that default to today (due soon, expired)
+        # must not serve yesterday's answer after midnight when nothing has been written
+        key = (func.__name__, date.today(), tuple(_cache_key_part(a) for a in args),
+               tuple(sorted((k, _cache_key_part(v)) for k, v in kwargs.items())))
+        check_external_changes()
+        with _read_cache_lock:
+            version = _data_version
+            if key in _read_cache:
+                _read_cache.move_to_end(key)
+                _read_cache_stats["hits"] += 1
+                result = _read_cache[key]
+                return list(result) if isinstance(result, list) else result
+            _read_cache_stats["misses"] += 1
+
+        result = func(*args, **kwargs)
+        with _read_cache_lock:
+            # Don't cache a result that may predate a write made while it was being read
+            if version == _data_version:
+                _read_cache[key] = result
+                while len(_read_cache) > READ_CACHE_SIZE:
+                    _read_cache.popitem(last=False)
+                    _read_cache_stats["evictions"] += 1
+        return list(result) if isinstance(result, list) else result
+    return wrapper
+
+def writes_data(func):
+    """
+    Bumps the data version after a write function runs. If no other process had written
+    since the last external change check, the change log rows this write added are
+    marked as seen, so check_external_changes() doesn't count them as external.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        global _seen_change_log_position
+        before = _current_change_log_position() if _seen_change_log_position is not None else None
+        try:
+            return func(*args, **kwargs)
+        finally:
+            bump_data_version()
+            if before is not None:
+                after = _current_change_log_position()
+                with _external_check_lock:
+                    if _seen_change_log_position == before and after is not None:
+                        _seen_change_log_position = after
+    return wrapper
+
+def get_read_cache_stats():
+    """Returns hit/miss/eviction counters plus the current size and data version."""
+    with _read_cache_lock:
+        return {**_read_cache_stats, "size": len(_read_cache), "max_size": READ_CACHE_SIZE,
+                "data_version": _data_version}
+
+def clear_read_cache():
+    with _read_cache_lock:
+        _read_cache.clear()
+
+# --- Member ID Index ---
+class MemberIdIndex:
+    """
+    In-memory set of existing member IDs, so hot paths (the scanner's video thread) can
+    check an ID without a query. Standard MEM-XXXXXXXX IDs are packed as 32-bit ints in a
+    sorted array (4 bytes each); anything else goes in a plain set. Loaded on first use
+    and kept up to date by this module's insert and delete functions.
+    """
+    _PACKED_ID = re.compile(r"MEM-([0-9A-F]{8})")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._packed = None
+        self._other = set()
+
+    def _pack(self, member_id):
+        match = self._PACKED_ID.fullmatch(member_id)
+        return int(match.group(1), 16) if match else None
+
+    def _ensure_loaded(self):
+        # Caller holds self._lock
+        if self._packed is not None:
+            return
+        conn = get_db_connection()
+        rows = conn.execute('SELECT member_id FROM members').fetchall()
+        conn.close()
+        packed, self._other = [], set()
+        for row in rows:
+            value = self._pack(row['member_id'])
+            if value is None:
+                self._other.add(row['member_id'])
+            else:
+                packed.append(value)
+        self._packed = array('I', sorted(packed))
+
+    def load(self):
+        """Loads the index now instead of on the first lookup."""
+        with self._lock:
+            self._ensure_loaded()
+
+    def __contains__(self, member_id):
+        value = self._pack(member_id)
+        with self._lock:
+            self._ensure_loaded()
+            if value is None:
+                return member_id in self._other
+            i = bisect.bisect_left(self._packed, value)
+            return i < len(self._packed) and self._packed[i] == value
+
+    def __len__(self):
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._packed) + len(self._other)
+
+    def add(self, new_ids):
+        with self._lock:
+            if self._packed is None:
+                return  # Not loaded yet; the IDs will be read from the table
+            packed = []
+            for member_id in new_ids:
+                value = self._pack(member_id)
+                if value is None:
+                    self._other.add(member_id)
+                else:
+                    packed.append(value)
+            if len(packed) == 1:
+                i = bisect.bisect_left(self._packed, packed[0])
+                if i == len(self._packed) or self._packed[i] != packed[0]:
+                    self._packed.insert(i, packed[0])
+            elif packed:
+                self._packed = array('I', sorted(set(self._packed).union(packed)))
+
+    def discard(self, member_id):
+        value = self._pack(member_id)
+        with self._lock:
+            if self._packed is None:
+                return
+            if value is None:
+                self._other.discard(member_id)
+                return
+            i = bisect.bisect_left(self._packed, value)
+            if i < len(self._packed) and self._packed[i] == value:
+                del self._packed[i]
+
+    def reset(self):
+        """Drops the index; it is reloaded from the database on next use."""
+        with self._lock:
+            self._packed = None
+            self._other = set()
+
+member_ids = MemberIdIndex()
+
+# Columns returned by list/detail queries. Photo bytes live in the profile_pics
+# table and are fetched separately with get_profile_pic().
+MEMBER_COLUMNS = ("id, member_id, name, dob, email, phone, address, department, "
+                  "member_since, next_renewal_date, profile_pic_hash")
+
+# Bump whenever _create_schema gains a table, column, index or migration. Databases stamped
+# with an older PRAGMA user_version run the (idempotent) setup once and are re-stamped.
+SCHEMA_VERSION = 3
+
+_schema_ready = set()  # database paths this process has already checked
+_schema_lock = threading.Lock()
+
+def init_db():
+    """
+    Initializes the database and creates tables if they don't exist.
+    Runs once per process per database (Streamlit calls it on every rerun), and skips
+    the setup entirely for a database already at SCHEMA_VERSION.
+    """
+    with _schema_lock:
+        if DB_PATH in _schema_ready:
+            return
+        with diagnostics.timed("startup", "init_db"):
+            conn = get_db_connection()
+            try:
+                if conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+                    _create_schema(conn)
+            finally:
+                conn.close()
+        _schema_ready.add(DB_PATH)
+
+def _create_schema(conn):
+    changes_before = conn.total_changes
     cursor = conn.cursor()
     
     # Members Table
@@ -27,10 +469,22 @@ def init_db():
             department TEXT,
             member_since TEXT NOT NULL,
             next_renewal_date TEXT NOT NULL,
-            profile_pic BLOB
+            profile_pic_hash TEXT REFERENCES profile_pics (hash)
         )
     ''')
-    
+
+    # Profile Pictures Table (content-addressed, shared by identical photos)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS profile_pics (
+            hash TEXT PRIMARY KEY,
+            data BLOB NOT NULL,
+            thumbnail BLOB
+        )
+    ''')
+    if 'thumbnail' not in {row['name'] for row in cursor.execute('PRAGMA table_info(profile_pics)')}:
+        cursor.execute('ALTER TABLE profile_pics ADD COLUMN thumbnail BLOB')
+    _migrate_inline_profile_pics(cursor)
+
     # Departments Table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS departments (
@@ -47,10 +501,58 @@ def init_db():
             renewal_date TEXT NOT NULL,
             previous_renewal_date TEXT NOT NULL,
             notes TEXT,
+            renewed_on TEXT,
+            department TEXT,
             FOREIGN KEY (member_id) REFERENCES members (member_id)
         )
     ''')
+    _migrate_renewal_history(cursor)
     
+    # Rendered QR code PNGs, keyed by payload and rendering parameters
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS qr_codes (
+            payload TEXT NOT NULL,
+            params TEXT NOT NULL,
+            png BLOB NOT NULL,
+            PRIMARY KEY (payload, params)
+        )
+    ''')
+
+    # Kiosk check-ins (written in batches by attendance.AttendanceWriter)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attendance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            member_id TEXT NOT NULL,
+            checked_in_at TEXT NOT NULL,
+            status TEXT NOT NULL,
+            station TEXT
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_checked_in_at ON attendance (checked_in_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_member ON attendance (member_id, checked_in_at)')
+
+    # Precomputed results written by the background scheduler (see scheduler.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS snapshots (
+            name TEXT PRIMARY KEY,
+            computed_at TEXT NOT NULL,
+            data TEXT NOT NULL
+        )
+    ''')
+
+    # Indexes for date-range dashboard queries
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_members_next_renewal_date ON members (next_renewal_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_members_member_since ON members (member_since, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_members_profile_pic_hash ON members (profile_pic_hash)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_members_name ON members (name, id)')
+    # Per-member history lookups (and deletes), and date-range history exports
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_renewal_history_member ON renewal_history (member_id, renewal_date, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_renewal_history_renewal_date ON renewal_history (renewal_date)')
+
+    _init_member_search(cursor)
+    _init_renewal_summary(cursor)
+    _init_change_log(cursor)
+
     # Check if default departments exist
     cursor.execute("SELECT COUNT(*) FROM departments")
     if cursor.fetchone()[0] == 0:
@@ -58,69 +560,813 @@ def init_db():
         for dept in default_departments:
             cursor.execute("INSERT OR IGNORE INTO departments (name) VALUES (?)", (dept,))
 
+    cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    conn.commit()
+    if conn.total_changes != changes_before:
+        bump_data_version()
+
+def _migrate_inline_profile_pics(cursor):
+    """Moves photos from the legacy members.profile_pic BLOB column into profile_pics."""
+    columns = {row['name'] for row in cursor.execute('PRAGMA table_info(members)')}
+    if 'profile_pic_hash' not in columns:
+        cursor.execute('ALTER TABLE members ADD COLUMN profile_pic_hash TEXT REFERENCES profile_pics (hash)')
+    if 'profile_pic' not in columns:
+        return
+
+    rows = cursor.execute('SELECT id, profile_pic FROM members WHERE profile_pic IS NOT NULL').fetchall()
+    for row in rows:
+        pic_hash = _store_profile_pic(cursor, row['profile_pic'])
+        cursor.execute('UPDATE members SET profile_pic_hash = ?, profile_pic = NULL WHERE id = ?', (pic_hash, row['id']))
+    try:
+        cursor.execute('ALTER TABLE members DROP COLUMN profile_pic')
+    except sqlite3.OperationalError:
+        # SQLite < 3.35 cannot drop columns; the emptied column is simply left unused.
+        pass
+
+def _migrate_renewal_history(cursor):
+    """
+    Adds the renewed_on and department columns to an older renewal_history table.
+    Existing rows predate them, so renewed_on is estimated as the date the membership
+    was due (capped at today) and department is taken from the member.
+    """
+    columns = {row['name'] for row in cursor.execute('PRAGMA table_info(renewal_history)')}
+    if 'renewed_on' in columns:
+        return
+    cursor.execute('ALTER TABLE renewal_history ADD COLUMN renewed_on TEXT')
+    cursor.execute('ALTER TABLE renewal_history ADD COLUMN department TEXT')
+    cursor.execute('''
+        UPDATE renewal_history SET
+            renewed_on = MIN(previous_renewal_date, date('now')),
+            department = (SELECT m.department FROM members m WHERE m.member_id = renewal_history.member_id)
+    ''')
+
+def _init_renewal_summary(cursor):
+    """
+    Creates renewal_monthly_summary (renewals per month and department) and the triggers
+    that keep it in step with renewal_history, so trend charts never scan the history.
+    The table is filled from existing history when it is first created.
+    """
+    exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'renewal_monthly_summary'").fetchone()
+    if not exists:
+        cursor.execute('''
+            CREATE TABLE renewal_monthly_summary (
+                month TEXT NOT NULL,
+                department TEXT NOT NULL,
+                renewals INTEGER NOT NULL,
+                PRIMARY KEY (month, department)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            INSERT INTO renewal_monthly_summary (month, department, renewals)
+            SELECT substr(COALESCE(renewed_on, date('now')), 1, 7), COALESCE(department, ''), COUNT(*)
+            FROM renewal_history GROUP BY 1, 2
+        ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS renewal_summary_insert AFTER INSERT ON renewal_history BEGIN
+            INSERT INTO renewal_monthly_summary (month, department, renewals)
+            VALUES (substr(COALESCE(new.renewed_on, date('now')), 1, 7), COALESCE(new.department, ''), 1)
+            ON CONFLICT (month, department) DO UPDATE SET renewals = renewals + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS renewal_summary_delete AFTER DELETE ON renewal_history BEGIN
+            UPDATE renewal_monthly_summary SET renewals = renewals - 1
+            WHERE month = substr(COALESCE(old.renewed_on, date('now')), 1, 7) AND department = COALESCE(old.department, '');
+            DELETE FROM renewal_monthly_summary
+            WHERE month = substr(COALESCE(old.renewed_on, date('now')), 1, 7) AND department = COALESCE(old.department, '')
+              AND renewals <= 0;
+        END
+    ''')
+
+# Tables copied to replicas: key column (stable across databases) and the columns shipped.
+# Upserts are applied in this order, deletes in reverse.
+REPLICATED_TABLES = {
+    "profile_pics": ("hash", ("hash", "data", "thumbnail")),
+    "departments": ("name", ("name",)),
+    "members": ("member_id", ("member_id", "name", "dob", "email", "phone", "address", "department",
+                              "member_since", "next_renewal_date", "profile_pic_hash")),
+    "renewal_history": ("id", ("id", "member_id", "renewal_date", "previous_renewal_date", "notes",
+                               "renewed_on", "department")),
+}
+
+def _init_change_log(cursor):
+    """
+    Creates change_log, which gets one row per inserted, updated or deleted row of the
+    replicated tables (via triggers), and sync_state, where a replica keeps how far it has
+    applied each source's log. Only keys are logged; row contents are read at export time.
+    A database upgraded to this schema starts with an empty log, so existing replicas
+    need one full copy before they can sync incrementally.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_key NOT NULL,
+            op TEXT NOT NULL,
+            changed_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            source TEXT PRIMARY KEY,
+            last_seq INTEGER NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    ''')
+    for table, (key, _) in REPLICATED_TABLES.items():
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS change_log_{table}_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO change_log (table_name, row_key, op) VALUES ('{table}', new.{key}, 'upsert');
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS change_log_{table}_update AFTER UPDATE ON {table} BEGIN
+                INSERT INTO change_log (table_name, row_key, op)
+                SELECT '{table}', old.{key}, 'delete' WHERE old.{key} IS NOT new.{key};
+                INSERT INTO change_log (table_name, row_key, op) VALUES ('{table}', new.{key}, 'upsert');
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS change_log_{table}_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO change_log (table_name, row_key, op) VALUES ('{table}', old.{key}, 'delete');
+            END
+        ''')
+
+_MEMBERS_FTS_INSERT_TRIGGER = '''
+    CREATE TRIGGER IF NOT EXISTS members_fts_insert AFTER INSERT ON members BEGIN
+        INSERT INTO members_fts (rowid, name, member_id, email, phone)
+        VALUES (new.id, new.name, new.member_id, new.email, new.phone);
+    END
+'''
+
+def _init_member_search(cursor):
+    """
+    Creates the members_fts full-text index over name, member_id, email and phone,
+    plus the triggers that keep it in sync with the members table.
+    The trigram tokenizer gives substring matches; older SQLite falls back to unicode61.
+    """
+    exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'members_fts'").fetchone()
+    if not exists:
+        for tokenizer in ('trigram', 'unicode61'):
+            try:
+                cursor.execute(f'''
+                    CREATE VIRTUAL TABLE members_fts USING fts5(
+                        name, member_id, email, phone,
+                        content='members', content_rowid='id', tokenize='{tokenizer}'
+                    )
+                ''')
+                break
+            except sqlite3.OperationalError:
+                continue
+        cursor.execute("INSERT INTO members_fts (members_fts) VALUES ('rebuild')")
+
+    cursor.execute(_MEMBERS_FTS_INSERT_TRIGGER)
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS members_fts_delete AFTER DELETE ON members BEGIN
+            INSERT INTO members_fts (members_fts, rowid, name, member_id, email, phone)
+            VALUES ('delete', old.id, old.name, old.member_id, old.email, old.phone);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS members_fts_update AFTER UPDATE OF name, member_id, email, phone ON members BEGIN
+            INSERT INTO members_fts (members_fts, rowid, name, member_id, email, phone)
+            VALUES ('delete', old.id, old.name, old.member_id, old.email, old.phone);
+            INSERT INTO members_fts (rowid, name, member_id, email, phone)
+            VALUES (new.id, new.name, new.member_id, new.email, new.phone);
+        END
+    ''')
+
+# --- Profile Picture Functions ---
+def _store_profile_pic(conn, pic_bytes, thumbnail=None):
+    """Stores photo bytes (and an optional thumbnail) once per distinct content and returns their hash."""
+    if not pic_bytes:
+        return None
+    pic_hash = hashlib.sha256(pic_bytes).hexdigest()
+    conn.execute('INSERT OR IGNORE INTO profile_pics (hash, data, thumbnail) VALUES (?, ?, ?)', (pic_hash, pic_bytes, thumbnail))
+    if thumbnail:
+        conn.execute('UPDATE profile_pics SET thumbnail = ? WHERE hash = ? AND thumbnail IS NULL', (thumbnail, pic_hash))
+    return pic_hash
+
+def _prune_profile_pic(conn, pic_hash):
+    """Deletes a stored photo once no member refers to it any more."""
+    if pic_hash:
+        conn.execute('''
+            DELETE FROM profile_pics WHERE hash = ?
+            AND NOT EXISTS (SELECT 1 FROM members WHERE profile_pic_hash = ?)
+        ''', (pic_hash, pic_hash))
+
+def get_profile_pic(pic_hash, thumbnail=False):
+    """
+    Returns the photo bytes for a profile_pic_hash, or None.
+    With thumbnail=True the small version is returned when one exists.
+    """
+    if not pic_hash:
+        return None
+    column = 'COALESCE(thumbnail, data)' if thumbnail else 'data'
+    conn = get_db_connection()
+    row = conn.execute(f'SELECT {column} AS data FROM profile_pics WHERE hash = ?', (pic_hash,)).fetchone()
+    conn.close()
+    return row['data'] if row else None
+
+def get_profile_pics(pic_hashes, thumbnail=False):
+    """Returns {hash: photo bytes} for many hashes at once."""
+    pic_hashes = list(dict.fromkeys(pic_hashes))
+    column = 'COALESCE(thumbnail, data)' if thumbnail else 'data'
+    conn = get_db_connection()
+    photos = {r['hash']: r['data'] for r in _select_in(conn, f'SELECT hash, {column} AS data FROM profile_pics', 'hash', pic_hashes)}
+    conn.close()
+    return photos
+
+def get_profile_pics_without_thumbnails(limit=50):
+    """Returns (hash, data) rows for stored photos that haven't been through the ingestion pipeline."""
+    conn = get_db_connection()
+    rows = conn.execute('SELECT hash, data FROM profile_pics WHERE thumbnail IS NULL LIMIT ?', (limit,)).fetchall()
+    conn.close()
+    return rows
+
+@writes_data
+def replace_profile_pic(old_hash, pic_bytes, thumbnail):
+    """Swaps a stored photo for a re-encoded version, repointing every member that uses it."""
+    conn = get_db_connection()
+    new_hash = _store_profile_pic(conn, pic_bytes, thumbnail)
+    if new_hash != old_hash:
+        conn.execute('UPDATE members SET profile_pic_hash = ? WHERE profile_pic_hash = ?', (new_hash, old_hash))
+        _prune_profile_pic(conn, old_hash)
     conn.commit()
     conn.close()
+    return new_hash
 
 # --- Member Functions ---
+@writes_data
 def add_member(member_data):
     conn = get_db_connection()
+    pic_hash = _store_profile_pic(conn, member_data.get('profile_pic'), member_data.get('profile_pic_thumbnail'))
     conn.execute('''
-        INSERT INTO members (member_id, name, dob, email, phone, address, department, member_since, next_renewal_date, profile_pic)
+        INSERT INTO members (member_id, name, dob, email, phone, address, department, member_since, next_renewal_date, profile_pic_hash)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     ''', (
         member_data['member_id'], member_data['name'], member_data['dob'], member_data['email'],
         member_data['phone'], member_data['address'], member_data['department'],
-        member_data['member_since'], member_data['next_renewal_date'], member_data['profile_pic']
+        member_data['member_since'], member_data['next_renewal_date'], pic_hash
     ))
     conn.commit()
     conn.close()
+    member_ids.add([member_data['member_id']])
+
+# Chunks at least this big are indexed for search in one statement (see add_members)
+BULK_FTS_MIN_ROWS = 100
+
+@writes_data
+def add_members(members, chunk_size=1000, progress=None):
+    """
+    Inserts many members (dicts shaped like add_member's member_data) with executemany,
+    committing once per chunk. progress(done, total) is called after every chunk.
+    Returns the number of rows inserted.
+
+    Indexing rows for search one trigger call at a time dominates large imports, so chunks
+    of BULK_FTS_MIN_ROWS or more drop the members_fts insert trigger inside their
+    transaction and index the new rows with one INSERT ... SELECT before it commits;
+    other connections never see the table without the trigger.
+    """
+    members = list(members)
+    total = len(members)
+    conn = get_db_connection()
+    try:
+        for start in range(0, total, chunk_size):
+            chunk = members[start:start + chunk_size]
+            with conn:
+                rows = [(
+                    m['member_id'], m['name'], m['dob'], m.get('email'), m.get('phone'), m.get('address'),
+                    m['department'], m['member_since'], m['next_renewal_date'],
+                    _store_profile_pic(conn, m.get('profile_pic'), m.get('profile_pic_thumbnail'))
+                ) for m in chunk]
+                bulk = len(rows) >= BULK_FTS_MIN_ROWS
+                if bulk:
+                    if not conn.in_transaction:
+                        conn.execute('BEGIN IMMEDIATE')  # the DROP must not commit on its own
+                    last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM members').fetchone()[0]
+                    conn.execute('DROP TRIGGER IF EXISTS members_fts_insert')
+                conn.executemany('''
+                    INSERT INTO members (member_id, name, dob, email, phone, address, department, member_since, next_renewal_date, profile_pic_hash)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+                if bulk:
+                    conn.execute('''
+                        INSERT INTO members_fts (rowid, name, member_id, email, phone)
+                        SELECT id, name, member_id, email, phone FROM members WHERE id > ?
+                    ''', (last_id,))
+                    conn.execute(_MEMBERS_FTS_INSERT_TRIGGER)
+            member_ids.add(row[0] for row in rows)
+            if progress:
+                progress(min(start + chunk_size, total), total)
+    finally:
+        conn.close()
+    return total
+
+def get_existing_member_ids(member_ids):
+    """Returns the subset of member_ids that are already taken."""
+    conn = get_db_connection()
+    existing = {r['member_id'] for r in _select_in(conn, 'SELECT member_id FROM members', 'member_id', member_ids)}
+    conn.close()
+    return existing
 
+@cached_read
 def get_all_members():
     conn = get_db_connection()
-    members = conn.execute('SELECT * FROM members ORDER BY name').fetchall()
+    members = conn.execute(f'SELECT {MEMBER_COLUMNS} FROM members ORDER BY name').fetchall()
+    conn.close()
+    return members
+
+@cached_read
+def get_dashboard_stats(today=None, due_within_days=30):
+    """
+    Returns total, due-soon and expired member counts computed in SQL.
+    Renewal dates are ISO strings, so range comparisons use the next_renewal_date index.
+    """
+    today = today or date.today()
+    due_by = today + timedelta(days=due_within_days)
+    conn = get_db_connection()
+    row = conn.execute('''
+        SELECT
+            (SELECT COUNT(*) FROM members) AS total_members,
+            (SELECT COUNT(*) FROM members WHERE next_renewal_date BETWEEN ? AND ?) AS due_soon,
+            (SELECT COUNT(*) FROM members WHERE next_renewal_date < ?) AS expired
+    ''', (today.isoformat(), due_by.isoformat(), today.isoformat())).fetchone()
+    conn.close()
+    return dict(row)
+
+MEMBER_FRAME_COLUMNS = ('member_id', 'name', 'department', 'dob', 'member_since', 'next_renewal_date')
+_FRAME_DATE_COLUMNS = ('dob', 'member_since', 'next_renewal_date')
+
+def _parse_iso_dates(values):
+    """Parses an object array of YYYY-MM-DD strings (None allowed) to datetime64; bad dates become NaT."""
+    try:
+        return values.astype('datetime64[D]').astype('datetime64[s]')
+    except ValueError:
+        return pd.to_datetime(pd.Series(values, dtype=object), format='%Y-%m-%d', errors='coerce').to_numpy()
+
+@cached_read
+def get_members_frame(columns=MEMBER_FRAME_COLUMNS, department=None):
+    """
+    Loads members column-wise into a DataFrame for analytics. Date columns are parsed to
+    datetime64 (unparseable dates become NaT), department is categorical and no photo data
+    is read; pass only the columns you need (as a tuple). The frame is shared through the read cache,
+    so treat it as read-only.
+    """
+    columns = tuple(columns)
+    unknown = set(columns) - set(MEMBER_FRAME_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown member columns: {', '.join(sorted(unknown))}")
+    sql = f'SELECT {", ".join(columns)} FROM members'
+    params = ()
+    if department:
+        sql += ' WHERE department = ?'; params = (department,)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.row_factory = None  # plain tuples are much cheaper to build than sqlite3.Row
+    rows = cursor.execute(sql + ' ORDER BY id', params).fetchall()
+    conn.close()
+
+    # One 2-D object array is far cheaper than transposing the rows with zip(*rows)
+    table = np.array(rows, dtype=object).reshape(len(rows), len(columns))
+    frame = {}
+    for i, name in enumerate(columns):
+        values = table[:, i]
+        if name in _FRAME_DATE_COLUMNS:
+            frame[name] = _parse_iso_dates(values)
+        elif name == 'department':
+            codes, categories = pd.factorize(values)
+            frame[name] = pd.Categorical.from_codes(codes, categories=categories.astype(str))
+        else:
+            frame[name] = pd.Series(values, dtype=object)
+    return pd.DataFrame(frame, columns=list(columns))
+
+@cached_read
+def get_recent_members(limit=5):
+    """Returns the most recently joined members (without profile pictures)."""
+    conn = get_db_connection()
+    members = conn.execute('''
+        SELECT member_id, name, department, member_since, next_renewal_date
+        FROM members ORDER BY member_since DESC, id DESC LIMIT ?
+    ''', (limit,)).fetchall()
+    conn.close()
+    return members
+
+def _search_clause(conn, query):
+    """Builds the WHERE clause and parameters for a member search query."""
+    query = (query or '').strip()
+    if not query:
+        return '', ()
+    fts_sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'members_fts'").fetchone()
+    is_trigram = fts_sql and 'trigram' in fts_sql['sql']
+    if is_trigram and len(query) >= 3:
+        phrase = '"' + query.replace('"', '""') + '"'
+        return 'WHERE id IN (SELECT rowid FROM members_fts WHERE members_fts MATCH ?)', (phrase,)
+    if not is_trigram and fts_sql:
+        terms = ' '.join('"' + t.replace('"', '""') + '"*' for t in query.split())
+        return 'WHERE id IN (SELECT rowid FROM members_fts WHERE members_fts MATCH ?)', (terms,)
+    # Trigrams need at least three characters; short queries use a bounded LIKE scan
+    # (with % and _ in the query matched literally).
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    pattern = f"%{escaped}%"
+    return ("WHERE name LIKE ? ESCAPE '\\' OR member_id LIKE ? ESCAPE '\\' "
+            "OR email LIKE ? ESCAPE '\\' OR phone LIKE ? ESCAPE '\\'",
+            (pattern, pattern, pattern, pattern))
+
+@cached_read
+def search_members(query, limit=50, offset=0):
+    """
+    Returns one page of members whose name, member_id, email or phone matches query,
+    ordered by name. An empty query pages through all members.
+    """
+    conn = get_db_connection()
+    where, params = _search_clause(conn, query)
+    members = conn.execute(f'''
+        SELECT member_id, name FROM members {where}
+        ORDER BY name, id LIMIT ? OFFSET ?
+    ''', params + (limit, offset)).fetchall()
     conn.close()
     return members
 
+@cached_read
+def count_search_results(query):
+    """Returns how many members match query (all members for an empty query)."""
+    conn = get_db_connection()
+    where, params = _search_clause(conn, query)
+    count = conn.execute(f'SELECT COUNT(*) FROM members {where}', params).fetchone()[0]
+    conn.close()
+    return count
+
+@cached_read
 def get_member_by_id(member_id):
     conn = get_db_connection()
-    member = conn.execute('SELECT * FROM members WHERE member_id = ?', (member_id,)).fetchone()
+    member = conn.execute(f'SELECT {MEMBER_COLUMNS} FROM members WHERE member_id = ?', (member_id,)).fetchone()
     conn.close()
     return member
 
+@writes_data
 def update_member(member_id, member_data):
+    """Updates a member's details. The photo is only replaced if 'profile_pic' is in member_data."""
     conn = get_db_connection()
     conn.execute('''
         UPDATE members
-        SET name = ?, dob = ?, email = ?, phone = ?, address = ?, department = ?, profile_pic = ?
+        SET name = ?, dob = ?, email = ?, phone = ?, address = ?, department = ?
         WHERE member_id = ?
     ''', (
         member_data['name'], member_data['dob'], member_data['email'],
-        member_data['phone'], member_data['address'], member_data['department'],
-        member_data['profile_pic'], member_id
+        member_data['phone'], member_data['address'], member_data['department'], member_id
     ))
+    if 'profile_pic' in member_data:
+        old = conn.execute('SELECT profile_pic_hash FROM members WHERE member_id = ?', (member_id,)).fetchone()
+        pic_hash = _store_profile_pic(conn, member_data['profile_pic'], member_data.get('profile_pic_thumbnail'))
+        conn.execute('UPDATE members SET profile_pic_hash = ? WHERE member_id = ?', (pic_hash, member_id))
+        if old and old['profile_pic_hash'] != pic_hash:
+            _prune_profile_pic(conn, old['profile_pic_hash'])
     conn.commit()
     conn.close()
 
+@writes_data
 def delete_member(member_id):
     conn = get_db_connection()
+    old = conn.execute('SELECT profile_pic_hash FROM members WHERE member_id = ?', (member_id,)).fetchone()
     conn.execute('DELETE FROM members WHERE member_id = ?', (member_id,))
     conn.execute('DELETE FROM renewal_history WHERE member_id = ?', (member_id,)) # Also clear history
+    conn.execute('DELETE FROM qr_codes WHERE payload = ?', (member_id,)) # And any cached QR codes
+    conn.execute('DELETE FROM attendance WHERE member_id = ?', (member_id,)) # And check-ins
+    if old:
+        _prune_profile_pic(conn, old['profile_pic_hash'])
     conn.commit()
     conn.close()
+    member_ids.discard(member_id)
     
+@writes_data
 def update_renewal_date(member_id, new_renewal_date):
     conn = get_db_connection()
     conn.execute('UPDATE members SET next_renewal_date = ? WHERE member_id = ?', (new_renewal_date, member_id))
     conn.commit()
     conn.close()
 
+# --- Export Functions ---
+def _iter_chunks(sql, params, chunk_size):
+    """Runs a query and yields its rows in chunks of chunk_size, holding one pooled connection."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+def iter_members(department=None, start_date=None, end_date=None, include_photos=False, chunk_size=5000):
+    """
+    Yields members in chunks, optionally filtered by department and member_since range.
+    Photo bytes are only included (as profile_pic) when include_photos is set.
+    """
+    columns = ', '.join(f'm.{c.strip()}' for c in MEMBER_COLUMNS.split(','))
+    if include_photos:
+        columns += ', p.data AS profile_pic'
+    sql = f'SELECT {columns} FROM members m'
+    if include_photos:
+        sql += ' LEFT JOIN profile_pics p ON p.hash = m.profile_pic_hash'
+    conditions, params = [], []
+    if department:
+        conditions.append('m.department = ?'); params.append(department)
+    if start_date:
+        conditions.append('m.member_since >= ?'); params.append(str(start_date))
+    if end_date:
+        conditions.append('m.member_since <= ?'); params.append(str(end_date))
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    return _iter_chunks(sql + ' ORDER BY m.id', params, chunk_size)
+
+def iter_renewal_history(department=None, start_date=None, end_date=None, chunk_size=5000):
+    """Yields renewal history rows in chunks, optionally filtered by member department and renewal_date range."""
+    sql = '''
+        SELECT h.id, h.member_id, m.name, m.department, h.renewal_date, h.previous_renewal_date, h.notes
+        FROM renewal_history h LEFT JOIN members m ON m.member_id = h.member_id
+    '''
+    conditions, params = [], []
+    if department:
+        conditions.append('m.department = ?'); params.append(department)
+    if start_date:
+        conditions.append('h.renewal_date >= ?'); params.append(str(start_date))
+    if end_date:
+        conditions.append('h.renewal_date <= ?'); params.append(str(end_date))
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    return _iter_chunks(sql + ' ORDER BY h.id', params, chunk_size)
+
+# --- QR Code Cache Functions ---
+def get_cached_qr_code(payload, params):
+    conn = get_db_connection()
+    row = conn.execute('SELECT png FROM qr_codes WHERE payload = ? AND params = ?', (payload, params)).fetchone()
+    conn.close()
+    return row['png'] if row else None
+
+def save_cached_qr_code(payload, params, png):
+    conn = get_db_connection()
+    conn.execute('INSERT OR REPLACE INTO qr_codes (payload, params, png) VALUES (?, ?, ?)', (payload, params, png))
+    conn.commit()
+    conn.close()
+
+def delete_cached_qr_codes(payload):
+    conn = get_db_connection()
+    conn.execute('DELETE FROM qr_codes WHERE payload = ?', (payload,))
+    conn.commit()
+    conn.close()
+
+# --- Snapshot Functions ---
+# Snapshots are derived data, so saving one doesn't bump the data version.
+def _json_default(value):
+    # numpy scalars (from pandas results) and dates
+    return value.item() if hasattr(value, 'item') else str(value)
+
+def save_snapshot(name, data):
+    """Stores the latest JSON-serializable result for `name`, replacing the previous one."""
+    conn = get_db_connection()
+    conn.execute('INSERT OR REPLACE INTO snapshots (name, computed_at, data) VALUES (?, ?, ?)',
+                 (name, datetime.now().isoformat(timespec='seconds'), json.dumps(data, default=_json_default)))
+    conn.commit()
+    conn.close()
+
+def get_snapshot(name):
+    """Returns (data, computed_at) for the latest snapshot called `name`, or None if there isn't one."""
+    conn = get_db_connection()
+    row = conn.execute('SELECT computed_at, data FROM snapshots WHERE name = ?', (name,)).fetchone()
+    conn.close()
+    return (json.loads(row['data']), datetime.fromisoformat(row['computed_at'])) if row else None
+
+@cached_read
+def get_upcoming_expiries(today=None, within_days=30, limit=100):
+    """Members whose next_renewal_date falls within the next `within_days` days, soonest first."""
+    today = today or date.today()
+    conn = get_db_connection()
+    rows = conn.execute('''
+        SELECT member_id, name, department, next_renewal_date FROM members
+        WHERE next_renewal_date BETWEEN ? AND ? ORDER BY next_renewal_date, id LIMIT ?
+    ''', (today.isoformat(), (today + timedelta(days=within_days)).isoformat(), limit)).fetchall()
+    conn.close()
+    return rows
+
+# --- Attendance Functions ---
+# Check-ins are an append-only log that no cached read depends on, so writing them
+# doesn't bump the data version (which would flush the read cache on every batch).
+def add_attendance_records(records):
+    """Inserts (member_id, checked_in_at, status, station) tuples in one transaction."""
+    conn = get_db_connection()
+    try:
+        with conn:
+            conn.executemany('INSERT INTO attendance (member_id, checked_in_at, status, station) VALUES (?, ?, ?, ?)',
+                             records)
+    finally:
+        conn.close()
+
+def get_recent_attendance(limit=20, since=None):
+    """Latest check-ins with member names, newest first; optionally only those at or after `since`."""
+    sql = '''
+        SELECT a.checked_in_at, a.member_id, m.name, m.department, a.status, a.station
+        FROM attendance a LEFT JOIN members m ON m.member_id = a.member_id
+    '''
+    params = []
+    if since:
+        sql += ' WHERE a.checked_in_at >= ?'; params.append(str(since))
+    conn = get_db_connection()
+    rows = conn.execute(sql + ' ORDER BY a.checked_in_at DESC, a.id DESC LIMIT ?', params + [limit]).fetchall()
+    conn.close()
+    return rows
+
+def count_attendance(day=None):
+    """Number of check-ins recorded on `day` (default today)."""
+    day = day or date.today()
+    conn = get_db_connection()
+    count = conn.execute('SELECT COUNT(*) FROM attendance WHERE checked_in_at >= ? AND checked_in_at < ?',
+                         (day.isoformat(), (day + timedelta(days=1)).isoformat())).fetchone()[0]
+    conn.close()
+    return count
+
+# --- Maintenance Functions ---
+def optimize_database(analyze=False):
+    """
+    Runs PRAGMA optimize, and a full ANALYZE if requested, so the query planner's
+    statistics follow the data as it grows.
+    """
+    conn = get_db_connection()
+    if analyze:
+        conn.execute('ANALYZE')
+    conn.execute('PRAGMA optimize')
+    conn.commit()
+    conn.close()
+
+# --- Replication ---
+# A primary exports "everything since sequence N" from change_log; replicas apply it and
+# remember the last sequence they have. See replication.py for the file format and CLI.
+def _change_log_position(conn):
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    return row[0] if row else 0
+
+def get_change_log_position():
+    """The newest sequence number this database has handed out (0 if none)."""
+    conn = get_db_connection()
+    position = _change_log_position(conn)
+    conn.close()
+    return position
+
+def _fetch_rows_by_key(conn, table, keys):
+    key, columns = REPLICATED_TABLES[table]
+    return {row[key]: dict(row) for row in _select_in(conn, f'SELECT {", ".join(columns)} FROM {table}', key, keys)}
+
+def export_changes(since_seq=0, limit=None):
+    """
+    Returns the changes logged after since_seq as {"since", "until", "changes"}.
+    Several changes to one row collapse into one entry: the row as it is now ("upsert"),
+    or a "delete" if it is gone. Entries are ordered by their last change. Photos travel
+    as profile_pics rows, so a blob is only shipped when a new hash was stored.
+    limit caps how many log entries are read; continue from the returned "until".
+    Raises ValueError if the log no longer reaches back to since_seq.
+    """
+    conn = get_db_connection()
+    try:
+        with diagnostics.timed("sync", "export_changes"):
+            conn.execute('BEGIN')  # one consistent snapshot of the log and the rows
+            position = _change_log_position(conn)
+            first = conn.execute('SELECT MIN(seq) FROM change_log').fetchone()[0]
+            if since_seq > position:
+                raise ValueError(f"Sequence {since_seq} is ahead of this database's change log ({position}).")
+            if since_seq < (first - 1 if first is not None else position):
+                raise ValueError(f"Changes after sequence {since_seq} have been pruned; take a full copy instead.")
+
+            sql = 'SELECT seq, table_name, row_key FROM change_log WHERE seq > ? ORDER BY seq'
+            params = [since_seq]
+            if limit:
+                sql += ' LIMIT ?'; params.append(limit)
+            latest = {}
+            until = since_seq
+            for seq, table, key in conn.execute(sql, params):
+                latest.pop((table, key), None)  # re-insert so the dict stays in last-change order
+                latest[(table, key)] = seq
+                until = seq
+            if not limit:
+                until = position
+
+            current = {table: _fetch_rows_by_key(conn, table, [k for t, k in latest if t == table])
+                       for table in REPLICATED_TABLES}
+            changes = []
+            for table, key in latest:
+                row = current[table].get(key)
+                if row is None:
+                    changes.append({"table": table, "key": key, "op": "delete"})
+                else:
+                    changes.append({"table": table, "key": key, "op": "upsert", "row": row})
+        return {"since": since_seq, "until": until, "changes": changes}
+    finally:
+        conn.close()
+
+def get_sync_position(source="primary"):
+    """The last sequence of `source`'s change log applied here (0 if never synced)."""
+    conn = get_db_connection()
+    row = conn.execute('SELECT last_seq FROM sync_state WHERE source = ?', (source,)).fetchone()
+    conn.close()
+    return row['last_seq'] if row else 0
+
+def _save_sync_position(conn, source, seq):
+    conn.execute('''
+        INSERT INTO sync_state (source, last_seq, applied_at) VALUES (?, ?, ?)
+        ON CONFLICT (source) DO UPDATE SET last_seq = excluded.last_seq, applied_at = excluded.applied_at
+    ''', (source, seq, datetime.now().isoformat(timespec="seconds")))
+
+def set_sync_position(source, seq):
+    """
+    Records that this database holds `source`'s data up to `seq`, e.g. right after
+    taking a full copy (pass the copy's get_change_log_position()).
+    """
+    conn = get_db_connection()
+    with conn:
+        _save_sync_position(conn, source, seq)
+    conn.close()
+
+@writes_data
+def apply_changes(delta, source="primary"):
+    """
+    Applies a delta from export_changes() in one transaction and records its "until" as
+    the new sync position for `source`. A delta that is already applied is skipped; one
+    that starts after the current position raises ValueError (a delta is missing).
+    Returns {"upserts", "deletes"} counts.
+    """
+    counts = {"upserts": 0, "deletes": 0}
+    by_table = {table: ([], []) for table in REPLICATED_TABLES}
+    for change in delta["changes"]:
+        upserts, deletes = by_table[change["table"]]
+        if change["op"] == "delete":
+            deletes.append((change["key"],))
+        else:
+            upserts.append(change["row"])
+
+    conn = get_db_connection()
+    try:
+        row = conn.execute('SELECT last_seq FROM sync_state WHERE source = ?', (source,)).fetchone()
+        position = row['last_seq'] if row else 0
+        if delta["until"] <= position:
+            return counts
+        if delta["since"] > position:
+            raise ValueError(f"Delta starts after sequence {delta['since']}, but {source} is only applied up to {position}.")
+
+        with diagnostics.timed("sync", "apply_changes"), conn:
+            for table, (key, columns) in reversed(REPLICATED_TABLES.items()):
+                deletes = by_table[table][1]
+                if table == "members":
+                    # The same clean-up as delete_member() for rows that only exist locally
+                    conn.executemany('DELETE FROM qr_codes WHERE payload = ?', deletes)
+                    conn.executemany('DELETE FROM attendance WHERE member_id = ?', deletes)
+                conn.executemany(f'DELETE FROM {table} WHERE {key} = ?', deletes)
+                counts["deletes"] += len(deletes)
+            for table, (key, columns) in REPLICATED_TABLES.items():
+                upserts = by_table[table][0]
+                updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c != key) or f"{key} = excluded.{key}"
+                conn.executemany(f'''
+                    INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})
+                    ON CONFLICT ({key}) DO UPDATE SET {updates}
+                ''', [tuple(row[c] for c in columns) for row in upserts])
+                counts["upserts"] += len(upserts)
+            _save_sync_position(conn, source, delta["until"])
+    finally:
+        conn.close()
+    if by_table["members"] != ([], []):
+        member_ids.reset()
+    return counts
+
+def prune_change_log(through_seq=None, older_than_days=None):
+    """
+    Deletes log entries up to and including through_seq (once every replica is past it)
+    and/or those older than older_than_days. A replica still behind a pruned entry can't
+    sync incrementally any more: export_changes() refuses it and it needs a new full copy.
+    Returns the number of entries deleted.
+    """
+    if through_seq is None and older_than_days is None:
+        raise ValueError("Give a sequence number or an age to prune the change log up to.")
+    conn = get_db_connection()
+    deleted = 0
+    with conn:
+        if through_seq is not None:
+            deleted += conn.execute('DELETE FROM change_log WHERE seq <= ?', (through_seq,)).rowcount
+        if older_than_days is not None:
+            deleted += conn.execute("DELETE FROM change_log WHERE changed_at < datetime('now', ?)",
+                                    (f"-{older_than_days} days",)).rowcount
+    conn.close()
+    return deleted
+
 # --- Department Functions ---
+@cached_read
 def get_all_departments():
     conn = get_db_connection()
     depts = conn.execute('SELECT name FROM departments ORDER BY name').fetchall()
     conn.close()
     return [d['name'] for d in depts]
 
+@writes_data
 def add_department(name):
     conn = get_db_connection()
     try:
@@ -132,6 +1378,7 @@ def add_department(name):
     finally:
         conn.close()
 
+@writes_data
 def delete_department(name):
     conn = get_db_connection()
     conn.execute('DELETE FROM departments WHERE name = ?', (name,))
@@ -139,24 +1386,118 @@ def delete_department(name):
     conn.close()
 
 # --- Renewal History Functions ---
+@writes_data
 def add_renewal_record(member_id, renewal_date, previous_renewal_date):
     conn = get_db_connection()
     conn.execute('''
-        INSERT INTO renewal_history (member_id, renewal_date, previous_renewal_date) 
-        VALUES (?, ?, ?)
-    ''', (member_id, renewal_date, previous_renewal_date))
+        INSERT INTO renewal_history (member_id, renewal_date, previous_renewal_date, renewed_on, department)
+        VALUES (?, ?, ?, ?, (SELECT department FROM members WHERE member_id = ?))
+    ''', (member_id, renewal_date, previous_renewal_date, date.today().isoformat(), member_id))
     conn.commit()
     conn.close()
 
-def get_renewal_history(member_id):
+def _renewal_date_sql(months):
+    """
+    SQL expression for next_renewal_date moved forward by `months`, clamped to the end of
+    the month like relativedelta (e.g. 2024-02-29 + 1 year -> 2025-02-28, not 2025-03-01).
+    """
+    return (f"MIN(date(m.next_renewal_date, '+{months} months'), "
+            f"date(m.next_renewal_date, 'start of month', '+{months + 1} months', '-1 day'))")
+
+@cached_read
+def get_member_ids_for_renewal(department=None, expiring_from=None, expiring_until=None):
+    """Returns member IDs in a department and/or whose next_renewal_date falls in a window."""
+    conditions, params = [], []
+    if department:
+        conditions.append('department = ?'); params.append(department)
+    if expiring_from:
+        conditions.append('next_renewal_date >= ?'); params.append(str(expiring_from))
+    if expiring_until:
+        conditions.append('next_renewal_date <= ?'); params.append(str(expiring_until))
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    conn = get_db_connection()
+    rows = conn.execute(f'SELECT member_id FROM members{where}', params).fetchall()
+    conn.close()
+    return [r['member_id'] for r in rows]
+
+@writes_data
+def renew_members(member_ids, period=relativedelta(years=1), notes=None):
+    """
+    Renews many members at once. Each member's next_renewal_date moves forward by
+    `period` (whole months/years) and a renewal_history row is written, all in one
+    transaction using set-based SQL. Returns a summary dict.
+    """
+    months = period.years * 12 + period.months
+    if months <= 0 or period.days or period.weeks:
+        raise ValueError("Renewal period must be a positive number of months or years.")
+    member_ids = list(dict.fromkeys(member_ids))
+    new_date = _renewal_date_sql(months)
+
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS renewal_batch (member_id TEXT PRIMARY KEY)')
+        conn.execute('DELETE FROM renewal_batch')
+        conn.executemany('INSERT INTO renewal_batch (member_id) VALUES (?)', [(m,) for m in member_ids])
+        renewed = conn.execute(f'''
+            INSERT INTO renewal_history (member_id, renewal_date, previous_renewal_date, notes, renewed_on, department)
+            SELECT m.member_id, {new_date}, m.next_renewal_date, ?, ?, m.department
+            FROM members m JOIN renewal_batch b ON b.member_id = m.member_id
+        ''', (notes, date.today().isoformat())).rowcount
+        conn.execute(f'''
+            UPDATE members AS m SET next_renewal_date = {new_date}
+            WHERE m.member_id IN (SELECT member_id FROM renewal_batch)
+        ''')
+        not_found = [r['member_id'] for r in conn.execute('''
+            SELECT b.member_id FROM renewal_batch b
+            WHERE NOT EXISTS (SELECT 1 FROM members m WHERE m.member_id = b.member_id)
+        ''')]
+        conn.execute('DELETE FROM renewal_batch')
+        conn.commit()
+    finally:
+        conn.close()
+    return {"requested": len(member_ids), "renewed": renewed, "not_found": not_found}
+
+@cached_read
+def get_renewal_history(member_id, limit=None, offset=0):
+    """Returns a member's renewals, newest first; one page of them if limit is given."""
     conn = get_db_connection()
     history = conn.execute('''
-        SELECT id, renewal_date, previous_renewal_date 
-        FROM renewal_history WHERE member_id = ? ORDER BY renewal_date DESC
-    ''', (member_id,)).fetchall()
+        SELECT id, renewal_date, previous_renewal_date, renewed_on, notes
+        FROM renewal_history WHERE member_id = ? ORDER BY renewal_date DESC, id DESC
+        LIMIT ? OFFSET ?
+    ''', (member_id, -1 if limit is None else limit, offset)).fetchall()
     conn.close()
     return history
 
+@cached_read
+def count_renewal_history(member_id):
+    conn = get_db_connection()
+    count = conn.execute('SELECT COUNT(*) FROM renewal_history WHERE member_id = ?', (member_id,)).fetchone()[0]
+    conn.close()
+    return count
+
+@cached_read
+def get_renewal_summary(start_month=None, end_month=None, department=None):
+    """
+    Returns (month, department, renewals) rows from the precomputed monthly summary,
+    oldest month first. Months are 'YYYY-MM' strings; members without a department are ''.
+    """
+    conditions, params = [], []
+    if start_month:
+        conditions.append('month >= ?'); params.append(start_month)
+    if end_month:
+        conditions.append('month <= ?'); params.append(end_month)
+    if department is not None:
+        conditions.append('department = ?'); params.append(department)
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    conn = get_db_connection()
+    rows = conn.execute(f'SELECT month, department, renewals FROM renewal_monthly_summary{where} ORDER BY month, department',
+                        params).fetchall()
+    conn.close()
+    return rows
+
+@writes_data
 def revert_last_renewal(history_id, member_id, previous_renewal_date):
     """Reverts the last renewal by deleting the history record and updating the member's renewal date."""
     conn = get_db_connection()
@@ -0,0 +1,116 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# --- Configuration ---
+ENABLED = os.environ.get("MEMBERS_DIAGNOSTICS", "1") != "0"
+# Counting every statement SQLite runs (trigger bodies included) calls back into Python for
+# each one and slows bulk writes down noticeably, so it is opt-in
+TRACE_STATEMENTS = ENABLED and os.environ.get("MEMBERS_DIAGNOSTICS_TRACE", "0") == "1"
+# Queries slower than this (and every page render) are also emitted as structured log lines
+SLOW_QUERY_MS = float(os.environ.get("MEMBERS_SLOW_QUERY_MS", "100"))
+RECENT_EVENTS = int(os.environ.get("MEMBERS_DIAGNOSTICS_EVENTS", "500"))
+
+logger = logging.getLogger("members.diagnostics")
+
+_lock = threading.Lock()
+_timings = {}
+_counters = {}
+_events = deque(maxlen=RECENT_EVENTS)
+_started_at = time.time()
+
+@functools.lru_cache(maxsize=1024)
+def _normalize_sql(sql):
+    return " ".join(sql.split())[:300]
+
+def _emit(event):
+    """Keeps an event in the recent-events buffer and writes it to the log as one JSON line."""
+    event = {"ts": round(time.time(), 3), **event}
+    with _lock:
+        _events.append(event)
+    logger.info(json.dumps(event, default=str))
+
+# --- Recording ---
+def record(category, name, elapsed_ms, rows=0):
+    """Adds one timed operation (a query, page render, QR render, ...) to the aggregates."""
+    if not ENABLED:
+        return
+    with _lock:
+        entry = _timings.get((category, name))
+        if entry is None:
+            entry = _timings[(category, name)] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0, "rows": 0}
+        entry["count"] += 1
+        entry["total_ms"] += elapsed_ms
+        entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+        entry["last_ms"] = elapsed_ms
+        entry["rows"] += max(rows, 0)
+    if category == "page" or (category == "query" and elapsed_ms >= SLOW_QUERY_MS):
+        _emit({"category": category, "name": name, "elapsed_ms": round(elapsed_ms, 3), "rows": rows})
+
+def record_query(sql, elapsed_ms, rows=0):
+    record("query", _normalize_sql(sql), elapsed_ms, rows)
+
+def record_fetch(sql, elapsed_ms, rows):
+    """Adds fetch time and fetched rows to a query without counting another execution."""
+    if not ENABLED:
+        return
+    with _lock:
+        entry = _timings.get(("query", _normalize_sql(sql)))
+        if entry is not None:
+            entry["total_ms"] += elapsed_ms
+            entry["rows"] += rows
+
+def increment(name, amount=1):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def trace_statement(statement):
+    """sqlite3 trace callback: counts every statement SQLite runs, including trigger bodies."""
+    increment("sqlite.statements")
+
+@contextmanager
+def timed(category, name):
+    """Times the enclosed block and records it under (category, name)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(category, name, (time.perf_counter() - start) * 1000)
+
+# --- Reporting ---
+def snapshot():
+    """Returns all timings, counters and recent events as plain JSON-serializable data."""
+    with _lock:
+        timings = [
+            {"category": category, "name": name, **entry,
+             "avg_ms": entry["total_ms"] / entry["count"] if entry["count"] else 0.0}
+            for (category, name), entry in _timings.items()
+        ]
+        return {
+            "enabled": ENABLED,
+            "trace_statements": TRACE_STATEMENTS,
+            "since": _started_at,
+            "generated_at": time.time(),
+            "timings": sorted(timings, key=lambda t: t["total_ms"], reverse=True),
+            "counters": dict(sorted(_counters.items())),
+            "recent_events": list(_events),
+        }
+
+def export_json(**extra):
+    """Serializes snapshot() (plus any extra sections) as a JSON document."""
+    return json.dumps({**snapshot(), **extra}, indent=2, default=str)
+
+def reset():
+    global _started_at
+    with _lock:
+        _timings.clear()
+        _counters.clear()
+        _events.clear()
+        _started_at = time.time()
@@ -0,0 +1,77 @@
+import base64
+import csv
+import io
+import tempfile
+import database as db
+
+MEMBER_FIELDS = ["id", "member_id", "name", "dob", "email", "phone", "address", "department",
+                 "member_since", "next_renewal_date", "profile_pic_hash"]
+RENEWAL_FIELDS = ["id", "member_id", "name", "department", "renewal_date", "previous_renewal_date", "notes"]
+
+# pyarrow is only imported once a Parquet schema is needed
+def _schema(fields, include_photos=False):
+    import pyarrow as pa
+    columns = [(f, pa.int64() if f == "id" else pa.string()) for f in fields]
+    if include_photos:
+        columns.append(("profile_pic", pa.binary()))
+    return pa.schema(columns)
+
+def _write_csv(chunks, fields, out):
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="", write_through=True)
+    writer = csv.writer(text)
+    writer.writerow(fields)
+    photo_index = fields.index("profile_pic") if "profile_pic" in fields else None
+    for rows in chunks:
+        if photo_index is None:
+            writer.writerows(rows)
+        else:
+            for row in rows:
+                row = list(row)
+                row[photo_index] = base64.b64encode(row[photo_index]).decode() if row[photo_index] else ""
+                writer.writerow(row)
+    text.detach()
+
+def _write_parquet(chunks, schema, out):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    with pq.ParquetWriter(out, schema) as writer:
+        for rows in chunks:
+            columns = {name: [row[i] for row in rows] for i, name in enumerate(schema.names)}
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+
+# --- Download Files ---
+def new_download_file():
+    """Opens an anonymous temporary file to build a download in, chunk by chunk."""
+    return tempfile.TemporaryFile()
+
+def finish_download_file(out):
+    """
+    Flushes a file from new_download_file() and returns its raw file object positioned at
+    the start, which st.download_button accepts (it rejects buffered/spooled wrappers).
+    """
+    out.flush()
+    raw = out.detach()
+    raw.seek(0)
+    return raw
+
+def _export(chunks, fields, schema, fmt):
+    out = new_download_file()
+    if fmt == "parquet":
+        _write_parquet(chunks, schema, out)
+    else:
+        _write_csv(chunks, fields, out)
+    return finish_download_file(out)
+
+def export_members(fmt="csv", department=None, start_date=None, end_date=None, include_photos=False, chunk_size=5000):
+    """
+    Writes members to a CSV or Parquet file chunk by chunk and returns it as a binary
+    file object positioned at the start. Photos are left out unless include_photos is set.
+    """
+    chunks = db.iter_members(department, start_date, end_date, include_photos, chunk_size)
+    fields = MEMBER_FIELDS + (["profile_pic"] if include_photos else [])
+    return _export(chunks, fields, _schema(MEMBER_FIELDS, include_photos), fmt)
+
+def export_renewal_history(fmt="csv", department=None, start_date=None, end_date=None, chunk_size=5000):
+    """Writes renewal history to a CSV or Parquet file chunk by chunk and returns it as a binary file object."""
+    chunks = db.iter_renewal_history(department, start_date, end_date, chunk_size)
+    return _export(chunks, RENEWAL_FIELDS, _schema(RENEWAL_FIELDS), fmt)
@@ -0,0 +1,407 @@
+"""
+Load-tests app.py with many concurrent simulated sessions against a seeded members.db.
+
+Each admin session is a Streamlit AppTest (its own session state) driven from its own
+process, picking actions from a weighted mix: dashboard views, member searches, profile
+edits and renewals. AppTest isn't safe to run on several threads of one process, so
+admin sessions share the database file but each has its own read cache and connection
+pool, like sessions spread over several Streamlit servers. Scanner sessions feed synthetic
+camera frames through the app's video callbacks from threads of the driver process, like
+the webcam threads do (kiosk check-ins included).
+
+Usage:
+    python loadtest.py --sessions 8 --duration 60 --size 10000
+    python loadtest.py --sessions 16 --scanners 4 --mix dashboard=4,search=3,edit=1,renew=1
+    python loadtest.py --db copy_of_members.db --pool-size 4 --busy-timeout 1000 --output load.json
+
+--db runs edits and renewals against the given database, so point it at a copy.
+Reports latency percentiles per action, throughput and SQLite lock errors as JSON.
+Errors shown by the app are reported separately from harness errors (actions the
+simulated session couldn't carry out); the run exits with status 1 if more than
+--max-harness-error-rate of the actions hit a harness error.
+"""
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+import database as db
+import diagnostics
+from benchmark import FIRST_NAMES, LAST_NAMES, git_revision, load_frames, seed_database
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+DEFAULT_MIX = "dashboard=4,search=3,edit=1,renew=1"
+
+def percentiles(samples):
+    """Latency summary (ms) of a list of samples: count, mean, p50/p90/p95/p99 and max."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    def pick(q):
+        return ordered[min(len(ordered) - 1, max(0, round(q * len(ordered)) - 1))]
+    return {"count": len(ordered), "mean_ms": statistics.fmean(ordered), "p50_ms": pick(0.50), "p90_ms": pick(0.90),
+            "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": ordered[-1]}
+
+# --- Admin Sessions ---
+class AdminSession:
+    """One simulated browser session: an AppTest that stays logged in between actions."""
+    def __init__(self, member_ids, seed, timeout):
+        from streamlit.testing.v1 import AppTest
+        self.member_ids = member_ids
+        self.rng = random.Random(seed)
+        self.at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        self.at.session_state["logged_in"] = True
+        self.at.run()
+
+    def _goto(self, page):
+        radio = self.at.sidebar.radio[0]
+        if radio.value == page:
+            self.at.run()  # already there: a rerun, as any widget interaction would cause
+        else:
+            radio.set_value(page).run()
+
+    def _open_member(self, member_id):
+        self._goto("View/Manage Members")
+        self.at.text_input(key="search_text").set_value(member_id).run()
+
+    def _widget(self, widgets, label):
+        for widget in widgets:
+            if widget.label == label:
+                return widget
+        raise LookupError(f"No '{label}' widget on the page")
+
+    def dashboard(self):
+        self._goto("Dashboard")
+
+    def search(self):
+        self._goto("View/Manage Members")
+        query = self.rng.choice([self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES),
+                                 self.rng.choice(FIRST_NAMES)[:3].lower()])
+        self.at.text_input(key="search_text").set_value(query).run()
+
+    def edit(self):
+        self._open_member(self.rng.choice(self.member_ids))
+        self._widget(self.at.text_input, "Name").set_value(f"{self.rng.choice(FIRST_NAMES)} {self.rng.choice(LAST_NAMES)} {self.rng.randrange(10**6)}")
+        self._widget(self.at.button, "Save Changes").click().run()
+
+    def renew(self):
+        self._open_member(self.rng.choice(self.member_ids))
+        self._widget(self.at.button, "Renew Membership for 1 Year").click().run()
+
+    def errors(self):
+        return [e.message for e in self.at.exception]
+
+ACTIONS = ("dashboard", "search", "edit", "renew")
+
+def parse_mix(text):
+    """Parses "dashboard=4,search=3" into {action: weight}, rejecting unknown actions."""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ACTIONS:
+            raise argparse.ArgumentTypeError(f"Unknown action '{name}' (choose from {', '.join(ACTIONS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+def configure_database(args, db_path=None):
+    pragmas = {"busy_timeout": args.busy_timeout} if args.busy_timeout else {}
+    if db_path or args.pool_size or pragmas:
+        db.configure(db_path=db_path, pool_size=args.pool_size, **pragmas)
+
+def run_admin(index, args, db_path, member_ids, ready, start, deadline, output):
+    """
+    Process target: starts one admin session, reports ready, waits for the start signal
+    and runs actions until the deadline (wall clock). Puts {"results", "counters",
+    "read_cache"} on output; each result is (action, ms, error kind or None, error), where
+    the kind is "app" for an exception shown by the app and "harness" for an action the
+    session couldn't carry out (AppTest timeouts, missing widgets, ...).
+    """
+    configure_database(args, db_path)
+    counters_before = diagnostics.snapshot()["counters"]
+    results = []
+    try:
+        session = AdminSession(member_ids, seed=index, timeout=args.timeout)
+    except Exception as e:
+        session = None
+        results.append(("session_start", 0.0, "harness", repr(e)))
+    ready.put(index)
+    start.wait()
+    if session is not None:
+        if args.ramp:
+            time.sleep(args.ramp * index / max(args.sessions, 1))
+        names, weights = list(args.mix), list(args.mix.values())
+        while time.time() < deadline.value:
+            action = session.rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                getattr(session, action)()
+                errors = session.errors()
+                kind, error = ("app", errors[0]) if errors else (None, None)
+            except Exception as e:
+                kind, error = "harness", repr(e)
+            results.append((action, (time.perf_counter() - started) * 1000, kind, error))
+            if args.think_time:
+                time.sleep(session.rng.uniform(0, 2 * args.think_time))
+    counters_after = diagnostics.snapshot()["counters"]
+    output.put({"results": results,
+                "counters": {k: v - counters_before.get(k, 0) for k, v in counters_after.items()},
+                "read_cache": db.get_read_cache_stats()})
+    db.close_all_connections()
+
+# --- Scanner Sessions ---
+def run_scanner(index, args, frames, deadline, results, lock):
+    """
+    Feeds frames through kiosk_frame_callback (even-numbered scanners) or the lookup
+    scanner's video_frame_callback at args.fps, like a webcam thread. Frames that
+    arrive while the previous one is still being processed are counted as late.
+    """
+    import av
+    from app import kiosk_frame_callback, video_frame_callback
+    from attendance import KioskStation
+    from scanner import ScanChannel, ScanDeduplicator, scanner_from_env
+
+    if index % 2 == 0:
+        kind = "kiosk"
+        callback = functools.partial(kiosk_frame_callback, station=KioskStation(f"loadtest-{index}"), channel=ScanChannel(),
+                                     dedup=ScanDeduplicator())
+    else:
+        kind = "lookup"
+        callback = functools.partial(video_frame_callback, channel=ScanChannel(), dedup=ScanDeduplicator())
+    scanner = scanner_from_env()
+    av_frames = [av.VideoFrame.from_ndarray(f, format="bgr24") for f in frames]
+    interval = 1.0 / args.fps
+    samples, late, errors = [], 0, []
+    next_frame = time.monotonic()
+    i = 0
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            callback(av_frames[i % len(av_frames)], scanner=scanner)
+        except Exception as e:
+            errors.append(repr(e))
+        samples.append((time.perf_counter() - start) * 1000)
+        i += 1
+        next_frame += interval
+        delay = next_frame - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            late += 1
+            next_frame = time.monotonic()
+    with lock:
+        results.append({"kind": kind, "samples": samples, "late": late, "errors": errors, "scanner": scanner.get_stats()})
+
+# --- Driver ---
+def prepare_database(args):
+    """Seeds a temporary database (or uses --db) and returns (path, temporary directory or None)."""
+    if args.db:
+        db.configure(db_path=args.db)
+        db.init_db()
+        return args.db, None
+    workdir = tempfile.mkdtemp(prefix="members_loadtest_")
+    path = os.path.join(workdir, "members.db")
+    print(f"Seeding {args.size:,} members into {path} ...", flush=True)
+    seed_database(path, args.size, args.photo_fraction, 1, 50)
+    return path, workdir
+
+def start_admin_sessions(args, db_path, member_ids):
+    """
+    Starts one process per admin session and waits until every session has loaded the
+    app. Returns (processes, start event, shared deadline, output queue).
+    """
+    ctx = multiprocessing.get_context("spawn")  # the driver already has database threads running
+    ready, output, start, deadline = ctx.Queue(), ctx.Queue(), ctx.Event(), ctx.Value("d", 0.0)
+    processes = [ctx.Process(target=run_admin, args=(i, args, db_path, member_ids, ready, start, deadline, output),
+                             name=f"loadtest-admin-{i}") for i in range(args.sessions)]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        try:
+            ready.get(timeout=args.timeout + 60)
+        except queue.Empty:
+            for process in processes:
+                process.terminate()
+            raise SystemExit("Admin sessions didn't start in time.")
+    return processes, start, deadline, output
+
+def collect_admin_results(processes, output, timeout):
+    """Gathers every admin process's output; a process that died or hung counts as a harness error."""
+    outputs = []
+    for _ in processes:
+        try:
+            outputs.append(output.get(timeout=timeout))
+        except queue.Empty:
+            break
+    for process in processes:
+        process.join(5)
+        if process.is_alive():
+            process.terminate()
+    missing = len(processes) - len(outputs)
+    if missing:
+        outputs.append({"results": [("session_lost", 0.0, "harness", "admin session process died or hung")] * missing,
+                        "counters": {}, "read_cache": {}})
+    return outputs
+
+def run(args):
+    configure_database(args)
+    db_path, workdir = prepare_database(args)
+    member_ids = [m['member_id'] for m in db.search_members("", limit=2000)]
+    if not member_ids:
+        raise SystemExit("The database has no members to work on.")
+    frames = load_frames(None, args.frame_count, member_ids=member_ids[:5]) if args.scanners else []
+
+    if args.scanners:
+        import app  # noqa: F401 -- runs the script once in bare mode; do it before any session starts
+    print(f"Starting {args.sessions} admin sessions ...", flush=True)
+    processes, start, shared_deadline, output = start_admin_sessions(args, db_path, member_ids)
+
+    counters_before = diagnostics.snapshot()["counters"]
+    scanner_results, lock = [], threading.Lock()
+    deadline = time.monotonic() + args.ramp + args.duration
+    shared_deadline.value = time.time() + args.ramp + args.duration
+    threads = [threading.Thread(target=run_scanner, args=(i, args, frames, deadline, scanner_results, lock),
+                                name=f"loadtest-scanner-{i}", daemon=True) for i in range(args.scanners)]
+
+    print(f"Running {args.sessions} admin and {args.scanners} scanner sessions for {args.duration:g} s ...", flush=True)
+    started = time.monotonic()
+    start.set()
+    for thread in threads:
+        thread.start()
+        if args.ramp:
+            time.sleep(args.ramp / len(threads))
+    outputs = collect_admin_results(processes, output, args.ramp + args.duration + args.timeout * 2)
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()) + args.timeout * 2)
+    elapsed = time.monotonic() - started
+
+    import attendance
+    attendance.writer.flush()
+    counters_after = diagnostics.snapshot()["counters"]
+    counter_deltas = {k: v - counters_before.get(k, 0) for k, v in counters_after.items()}
+    read_cache = {}
+    for out in outputs:
+        for name, value in out["counters"].items():
+            counter_deltas[name] = counter_deltas.get(name, 0) + value
+        for name in ("hits", "misses", "evictions", "invalidations"):
+            read_cache[name] = read_cache.get(name, 0) + out["read_cache"].get(name, 0)
+    counter_deltas = {k: v for k, v in sorted(counter_deltas.items()) if v}
+
+    # Failed actions are left out of the latency samples but counted against the run
+    results = [r for out in outputs for r in out["results"]]
+    completed = [ms for _, ms, kind, _ in results if kind is None]
+    actions = {}
+    for name in sorted({r[0] for r in results}):
+        rows = [r for r in results if r[0] == name]
+        actions[name] = {**percentiles([ms for _, ms, kind, _ in rows if kind is None]),
+                         "attempts": len(rows),
+                         "app_errors": sum(1 for r in rows if r[2] == "app"),
+                         "harness_errors": sum(1 for r in rows if r[2] == "harness")}
+    errors = [error for *_, error in results if error]
+    harness_errors = sum(1 for r in results if r[2] == "harness")
+    scanners = {}
+    for kind in sorted({s["kind"] for s in scanner_results}):
+        runs = [s for s in scanner_results if s["kind"] == kind]
+        samples = [ms for s in runs for ms in s["samples"]]
+        scanners[kind] = {**percentiles(samples), "sessions": len(runs), "late_frames": sum(s["late"] for s in runs),
+                          "errors": sum(len(s["errors"]) for s in runs),
+                          "achieved_fps": len(samples) / elapsed / max(len(runs), 1)}
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": sys.version.split()[0],
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "summary": {
+            "elapsed_s": elapsed,
+            "actions": len(results),
+            "completed": len(completed),
+            "throughput_per_s": len(completed) / elapsed if elapsed else 0.0,
+            "app_errors": sum(1 for r in results if r[2] == "app"),
+            "harness_errors": harness_errors,
+            "harness_error_rate": harness_errors / len(results) if results else 0.0,
+            "lock_errors": counter_deltas.get("sqlite.lock_errors", 0),
+            "locked_exceptions": sum(1 for e in errors if "locked" in e or "busy" in e),
+            "all_actions": percentiles(completed),
+        },
+        "actions": actions,
+        "scanners": scanners,
+        "sample_errors": sorted(set(errors))[:20],
+        "counters": counter_deltas,
+        "read_cache": read_cache,
+        "pool": db.get_pool_stats(),
+        "attendance_writer": attendance.writer.get_stats(),
+    }
+    db.close_all_connections()
+    if workdir and not args.keep_db:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+def print_report(report):
+    summary = report["summary"]
+    print(f"  {summary['completed']} of {summary['actions']} actions completed in {summary['elapsed_s']:.1f} s = "
+          f"{summary['throughput_per_s']:.2f} actions/s, {summary['app_errors']} app errors, "
+          f"{summary['lock_errors']} SQLite lock errors")
+    if summary["harness_errors"]:
+        print(f"  HARNESS ERRORS: {summary['harness_errors']} actions ({summary['harness_error_rate']:.1%}) were not "
+              f"carried out; the latencies below leave them out")
+    for name, stats in [("all", summary["all_actions"]), *report["actions"].items()]:
+        if stats["count"]:
+            failed = stats.get("app_errors", summary["app_errors"]) + stats.get("harness_errors", summary["harness_errors"])
+            print(f"  {name:12} n={stats['count']:<6} failed={failed:<4} p50 {stats['p50_ms']:9.1f} ms  p95 {stats['p95_ms']:9.1f} ms  "
+                  f"p99 {stats['p99_ms']:9.1f} ms  max {stats['max_ms']:9.1f} ms")
+    for kind, stats in report["scanners"].items():
+        if stats["count"]:
+            print(f"  scanner {kind:6} {stats['achieved_fps']:.1f} fps/session  p50 {stats['p50_ms']:7.1f} ms  "
+                  f"p95 {stats['p95_ms']:7.1f} ms  late frames {stats['late_frames']}")
+    for error in report["sample_errors"][:5]:
+        print(f"  error: {error[:200]}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent admin sessions")
+    parser.add_argument("--scanners", type=int, default=2, help="concurrent scanner sessions (half of them kiosks)")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to run after the ramp-up")
+    parser.add_argument("--ramp", type=float, default=0, help="seconds over which sessions are started")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help=f"action weights (default {DEFAULT_MIX})")
+    parser.add_argument("--think-time", type=float, default=0.2, help="mean pause between a session's actions (s)")
+    parser.add_argument("--fps", type=float, default=10, help="frames per second per scanner session")
+    parser.add_argument("--frame-count", type=int, default=60, help="distinct synthetic frames per scanner")
+    parser.add_argument("--size", type=int, default=10_000, help="members to seed (ignored with --db)")
+    parser.add_argument("--photo-fraction", type=float, default=0.3)
+    parser.add_argument("--db", help="use this database instead of seeding one (it will be modified)")
+    parser.add_argument("--pool-size", type=int, help="override MEMBERS_DB_POOL_SIZE")
+    parser.add_argument("--busy-timeout", type=int, help="override MEMBERS_DB_BUSY_TIMEOUT (ms)")
+    parser.add_argument("--timeout", type=float, default=60, help="per script run timeout (s)")
+    parser.add_argument("--max-harness-error-rate", type=float, default=0.0,
+                        help="fail the run if more than this fraction of actions hit a harness error")
+    parser.add_argument("--keep-db", action="store_true", help="don't delete the seeded database")
+    parser.add_argument("--output", default="loadtest_output.json")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    print_report(report)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Wrote {args.output}")
+    if report["summary"]["harness_error_rate"] > args.max_harness_error_rate:
+        raise SystemExit(f"{report['summary']['harness_errors']} actions hit a harness error; "
+                         f"the results don't reflect the requested load.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import calendar
+import numpy as np
+import pandas as pd
+from datetime import date
+
+# Renewal status labels, in display order
+STATUSES = ["Expired", "Due Soon", "Active"]
+NO_DEPARTMENT = "No Department"
+# Ages are capped here (dates of birth further back count as this old)
+MAX_AGE = 150
+
+def _days(dates):
+    """Returns a date column as datetime64[D] values plus its NaT mask."""
+    days = np.asarray(dates, dtype="datetime64[D]")
+    return days, np.isnat(days)
+
+def _today(today):
+    return np.datetime64(today or date.today(), "D")
+
+# --- Vectorized Helpers ---
+# These take datetime64 columns (as returned by db.get_members_frame()) and work on whole
+# columns with numpy date arithmetic. Missing dates (NaT) give <NA> results.
+def _birthday_cutoffs(today, max_age=MAX_AGE):
+    """
+    The latest date of birth for each age 1..max_age on `today`, oldest first: someone is at
+    least `a` years old if born on or before `today` moved back `a` years (Feb 29 -> Feb 28).
+    """
+    cutoffs = []
+    for age in range(max_age, 0, -1):
+        year = today.year - age
+        day = 28 if (today.month, today.day) == (2, 29) and not calendar.isleap(year) else today.day
+        cutoffs.append(date(year, today.month, day))
+    return np.array(cutoffs, dtype="datetime64[D]")
+
+def ages(dob, today=None):
+    """Age in whole years on `today` for each date of birth."""
+    today = today or date.today()
+    days, missing = _days(dob)
+    cutoffs = _birthday_cutoffs(today)
+    # Number of cutoffs on or after the date of birth = completed years
+    result = len(cutoffs) - np.searchsorted(cutoffs, days, side="left")
+    return pd.Series(pd.arrays.IntegerArray(np.where(missing, 0, result), missing),
+                     index=getattr(dob, "index", None), name="age")
+
+def days_until_renewal(next_renewal_date, today=None):
+    """Days from `today` to each renewal date (negative once expired)."""
+    days, missing = _days(next_renewal_date)
+    delta = (days - _today(today)).astype(np.int64)
+    return pd.Series(pd.arrays.IntegerArray(np.where(missing, 0, delta), missing),
+                     index=getattr(next_renewal_date, "index", None), name="days_until_renewal")
+
+def _status_codes(next_renewal_date, today, due_within_days):
+    days, missing = _days(next_renewal_date)
+    delta = (days - _today(today)).astype(np.int64)
+    codes = np.where(delta < 0, 0, np.where(delta <= due_within_days, 1, 2)).astype(np.int8)
+    codes[missing] = -1
+    return codes
+
+def renewal_status(next_renewal_date, today=None, due_within_days=30):
+    """
+    Classifies each renewal date as Expired (before today), Due Soon (within
+    due_within_days, inclusive) or Active, matching db.get_dashboard_stats().
+    """
+    codes = _status_codes(next_renewal_date, today, due_within_days)
+    return pd.Series(pd.Categorical.from_codes(codes, categories=STATUSES, ordered=True),
+                     index=getattr(next_renewal_date, "index", None), name="status")
+
+# --- Summaries ---
+def department_summary(frame, today=None, due_within_days=30):
+    """
+    Per-department member counts by renewal status plus median and mean age,
+    computed from a db.get_members_frame() DataFrame (department, dob and
+    next_renewal_date columns).
+    """
+    columns = ["members", *STATUSES, "median_age", "mean_age"]
+    if frame.empty:
+        return pd.DataFrame(columns=columns)
+    department = frame["department"].cat
+    names = [*department.categories.astype(str), NO_DEPARTMENT]
+    # Members without a department (code -1) go in the last bucket
+    dept_codes = np.where(department.codes < 0, len(names) - 1, department.codes)
+    status_codes = _status_codes(frame["next_renewal_date"], today, due_within_days)
+    counted = status_codes >= 0
+    counts = np.bincount(dept_codes[counted] * len(STATUSES) + status_codes[counted],
+                         minlength=len(names) * len(STATUSES)).reshape(len(names), len(STATUSES))
+    members = np.bincount(dept_codes, minlength=len(names))
+
+    age = ages(frame["dob"], today)
+    age_stats = pd.Series(age.to_numpy(dtype="float64", na_value=np.nan)).groupby(dept_codes).agg(["median", "mean"])
+    summary = pd.DataFrame(counts, index=pd.Index(names, name="department"), columns=STATUSES)
+    summary.insert(0, "members", members)
+    summary["median_age"] = age_stats["median"].reindex(range(len(names))).to_numpy()
+    summary["mean_age"] = age_stats["mean"].reindex(range(len(names))).round(1).to_numpy()
+    return summary[summary["members"] > 0].sort_values("members", ascending=False)
@@ -0,0 +1,222 @@
+import functools
+import io
+import multiprocessing
+import os
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image, ImageDraw, ImageFont, UnidentifiedImageError
+import database as db
+from export import new_download_file, finish_download_file
+from qr_codes import render_qr_code
+
+# --- Layout (300 dpi) ---
+DPI = 300
+CARD_SIZE = (1011, 638)        # ID-1 / CR80 card, 85.6 x 54 mm
+PAGE_SIZE = (2480, 3508)       # A4
+PAGE_POINTS = (595.28, 841.89)  # A4 in PDF points
+CARDS_PER_ROW, ROWS_PER_PAGE = 2, 5
+CARDS_PER_PAGE = CARDS_PER_ROW * ROWS_PER_PAGE
+HEADER_COLOR = (31, 64, 104)
+
+# Below this many cards the work is done in-process; starting workers would cost more
+MIN_CARDS_FOR_POOL = 24
+CARD_WORKERS = int(os.environ.get("CARD_WORKERS", str(os.cpu_count() or 2)))
+
+@functools.lru_cache(maxsize=None)
+def _font(size, bold=False):
+    name = "DejaVuSans-Bold.ttf" if bold else "DejaVuSans.ttf"
+    try:
+        return ImageFont.truetype(name, size)
+    except OSError:
+        return ImageFont.load_default(size=size)
+
+def _fit_text(draw, text, max_width, size, bold=False):
+    """Shrinks the font until text fits in max_width."""
+    while size > 16 and draw.textlength(text, font=_font(size, bold)) > max_width:
+        size -= 2
+    return _font(size, bold)
+
+def _load_photo(data, size):
+    """Decodes a stored photo and fits it in size; None if there is none or Pillow can't read it."""
+    if not data:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as photo:
+            photo = photo.convert("RGB")
+    except (UnidentifiedImageError, OSError):
+        # Photos stored before ingestion was validated may be unreadable
+        return None
+    photo.thumbnail(size)
+    return photo
+
+def render_card(card):
+    """
+    Draws one member card (photo, name, ID, department, validity and QR code)
+    and returns it as a PIL image. `card` is a dict from build_card_data().
+    """
+    img = Image.new("RGB", CARD_SIZE, "white")
+    draw = ImageDraw.Draw(img)
+    width, height = CARD_SIZE
+    draw.rectangle([0, 0, width, 110], fill=HEADER_COLOR)
+    draw.text((40, 55), "MEMBER CARD", font=_font(48, bold=True), fill="white", anchor="lm")
+
+    # Photo (or a placeholder) on the left
+    photo_box = (40, 150, 300, 450)
+    photo = _load_photo(card.get("photo"), (photo_box[2] - photo_box[0], photo_box[3] - photo_box[1]))
+    if photo is not None:
+        img.paste(photo, (photo_box[0] + (260 - photo.width) // 2, photo_box[1] + (300 - photo.height) // 2))
+    else:
+        draw.rectangle(photo_box, fill=(225, 228, 232))
+        draw.text(((photo_box[0] + photo_box[2]) // 2, (photo_box[1] + photo_box[3]) // 2), "No Photo",
+                  font=_font(30), fill=(120, 120, 120), anchor="mm")
+
+    # QR code on the right
+    qr_size = 300
+    with Image.open(io.BytesIO(render_qr_code(card["member_id"], box_size=6, border=2))) as qr:
+        qr = qr.convert("RGB").resize((qr_size, qr_size), Image.NEAREST)
+        img.paste(qr, (width - qr_size - 40, 150))
+
+    # Details in between
+    text_x, text_width = 330, width - qr_size - 40 - 330 - 20
+    draw.text((text_x, 160), card["name"], font=_fit_text(draw, card["name"], text_width, 44, bold=True), fill="black")
+    draw.text((text_x, 240), card["member_id"], font=_font(32), fill=(60, 60, 60))
+    draw.text((text_x, 300), card.get("department") or "", font=_fit_text(draw, card.get("department") or "", text_width, 32), fill=(60, 60, 60))
+    draw.text((text_x, 400), f"Valid until {card['next_renewal_date']}", font=_font(28), fill=(60, 60, 60))
+    draw.rectangle([0, 0, width - 1, height - 1], outline=(200, 200, 200), width=3)
+    return img
+
+# --- Worker Jobs (top-level so they can be pickled) ---
+def _render_card_png(card):
+    buf = io.BytesIO()
+    render_card(card).save(buf, format="PNG", compress_level=1)
+    return card["member_id"], buf.getvalue()
+
+def _render_page_jpeg(cards):
+    """Lays out up to CARDS_PER_PAGE cards on an A4 page and returns it as JPEG bytes."""
+    page = Image.new("RGB", PAGE_SIZE, "white")
+    margin_x = (PAGE_SIZE[0] - CARDS_PER_ROW * CARD_SIZE[0]) // (CARDS_PER_ROW + 1)
+    margin_y = (PAGE_SIZE[1] - ROWS_PER_PAGE * CARD_SIZE[1]) // (ROWS_PER_PAGE + 1)
+    for i, card in enumerate(cards):
+        row, col = divmod(i, CARDS_PER_ROW)
+        x = margin_x + col * (CARD_SIZE[0] + margin_x)
+        y = margin_y + row * (CARD_SIZE[1] + margin_y)
+        page.paste(render_card(card), (x, y))
+    buf = io.BytesIO()
+    page.save(buf, format="JPEG", quality=90, dpi=(DPI, DPI))
+    return buf.getvalue()
+
+# --- Streaming PDF Writer ---
+class _JpegPdfWriter:
+    """
+    Writes a PDF whose pages are full-page JPEG images, one page at a time.
+    Pillow's PDF writer needs every page in memory at once; this keeps only the current one.
+    """
+    def __init__(self, out):
+        self.out = out
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = 3  # 1 = catalog, 2 = page tree (written last)
+        out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write_object(self, obj_id, body, stream=None):
+        self.offsets[obj_id] = self.out.tell()
+        self.out.write(b"%d 0 obj\n" % obj_id + body)
+        if stream is not None:
+            self.out.write(b"\nstream\n" + stream + b"\nendstream")
+        self.out.write(b"\nendobj\n")
+
+    def add_page(self, jpeg_bytes, pixel_size):
+        image_id, content_id, page_id = self.next_id, self.next_id + 1, self.next_id + 2
+        self.next_id += 3
+        width_pt, height_pt = PAGE_POINTS
+        self._write_object(image_id, b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceRGB "
+                                     b"/BitsPerComponent 8 /Filter /DCTDecode /Length %d >>"
+                           % (pixel_size[0], pixel_size[1], len(jpeg_bytes)), jpeg_bytes)
+        content = b"q %.2f 0 0 %.2f 0 0 cm /Im0 Do Q" % (width_pt, height_pt)
+        self._write_object(content_id, b"<< /Length %d >>" % len(content), content)
+        self._write_object(page_id, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] "
+                                    b"/Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>"
+                           % (width_pt, height_pt, image_id, content_id))
+        self.page_ids.append(page_id)
+
+    def close(self):
+        self._write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        kids = b" ".join(b"%d 0 R" % p for p in self.page_ids)
+        self._write_object(2, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.page_ids)))
+        xref_offset = self.out.tell()
+        self.out.write(b"xref\n0 %d\n0000000000 65535 f \n" % self.next_id)
+        for obj_id in range(1, self.next_id):
+            self.out.write(b"%010d 00000 n \n" % self.offsets[obj_id])
+        self.out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (self.next_id, xref_offset))
+
+# --- Card Generation ---
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    """A process pool shared by all card jobs. Uses spawn so workers don't inherit server threads."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=CARD_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+def _discard_executor(executor):
+    """Drops a broken pool (a worker died) so the next job starts a fresh one."""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def build_card_data(members):
+    """Turns member rows into picklable card dicts, fetching photo thumbnails in bulk."""
+    members = list(members)
+    photos = db.get_profile_pics([m['profile_pic_hash'] for m in members if m['profile_pic_hash']], thumbnail=True)
+    return [{
+        "member_id": m['member_id'], "name": m['name'], "department": m['department'],
+        "next_renewal_date": m['next_renewal_date'], "photo": photos.get(m['profile_pic_hash']),
+    } for m in members]
+
+def generate_cards(members, fmt="zip", progress=None):
+    """
+    Renders cards for `members` (rows with member_id, name, department, next_renewal_date,
+    profile_pic_hash) into a ZIP of PNGs or a multi-page PDF, spreading the rendering
+    over a process pool. Output is written to a temporary file as results arrive and
+    returned positioned at the start. progress(done, total) reports cards finished.
+    """
+    cards = build_card_data(members)
+    total = len(cards)
+    use_pool = total >= MIN_CARDS_FOR_POOL
+
+    def run_jobs(func, items, chunksize):
+        # Results come back in order, as soon as each one (and those before it) is done
+        if not use_pool:
+            yield from map(func, items)
+            return
+        executor = _get_executor()
+        try:
+            yield from executor.map(func, items, chunksize=chunksize)
+        except BrokenProcessPool:
+            _discard_executor(executor)
+            raise
+
+    out = new_download_file()
+
+    if fmt == "pdf":
+        pages = [cards[i:i + CARDS_PER_PAGE] for i in range(0, total, CARDS_PER_PAGE)]
+        writer = _JpegPdfWriter(out)
+        for i, jpeg in enumerate(run_jobs(_render_page_jpeg, pages, chunksize=1)):
+            writer.add_page(jpeg, PAGE_SIZE)
+            if progress:
+                progress(min((i + 1) * CARDS_PER_PAGE, total), total)
+        writer.close()
+    else:
+        with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_STORED) as archive:
+            for i, (member_id, png) in enumerate(run_jobs(_render_card_png, cards, chunksize=16)):
+                archive.writestr(f"{member_id}_card.png", png)
+                if progress and (i % 10 == 9 or i + 1 == total):
+                    progress(i + 1, total)
+    return finish_download_file(out)
@@ -0,0 +1,90 @@
+import uuid
+from datetime import date
+import pandas as pd
+import database as db
+
+REQUIRED_COLUMNS = ["name", "dob", "department"]
+OPTIONAL_COLUMNS = ["email", "phone", "address", "member_since"]
+DATE_COLUMNS = ["dob", "member_since"]
+DATE_FORMAT = "%Y-%m-%d"
+
+def read_member_file(file, filename):
+    """Reads an uploaded CSV or XLSX file into a DataFrame of strings."""
+    if filename.lower().endswith((".xlsx", ".xls")):
+        df = pd.read_excel(file, dtype=str)
+    else:
+        df = pd.read_csv(file, dtype=str)
+    # Accept headers such as "Date of Birth " or "Member Since"
+    df.columns = [str(c).strip().lower().replace(" ", "_") for c in df.columns]
+    df = df.rename(columns={"date_of_birth": "dob", "full_name": "name"})
+    if filename.lower().endswith((".xlsx", ".xls")):
+        # Excel date cells come through as "YYYY-MM-DD 00:00:00"
+        for column in DATE_COLUMNS:
+            if column in df.columns:
+                df[column] = df[column].str.replace(r" 00:00:00$", "", regex=True)
+    return df
+
+def generate_member_ids(count):
+    """Generates `count` new MEM- IDs that are unique among themselves and in the database."""
+    ids = set()
+    while len(ids) < count:
+        candidates = {f"MEM-{uuid.uuid4().hex[:8].upper()}" for _ in range(count - len(ids))}
+        ids |= candidates - db.get_existing_member_ids(candidates)
+    return list(ids)
+
+def validate_members(df, departments, today=None):
+    """
+    Validates and normalizes imported rows.
+    Returns (valid, report): `valid` holds the rows ready to insert (with IDs and
+    renewal dates), `report` has one row per input row with its status and problems.
+    """
+    today = pd.Timestamp(today or date.today())
+    missing_columns = [c for c in REQUIRED_COLUMNS if c not in df.columns]
+    if missing_columns:
+        raise ValueError(f"Missing required column(s): {', '.join(missing_columns)}")
+
+    df = df.copy()
+    for column in OPTIONAL_COLUMNS:
+        if column not in df.columns:
+            df[column] = None
+    for column in REQUIRED_COLUMNS + OPTIONAL_COLUMNS:
+        df[column] = df[column].astype("string").str.strip().replace("", pd.NA)
+
+    dob = pd.to_datetime(df["dob"], errors="coerce", format=DATE_FORMAT)
+    parsed_since = pd.to_datetime(df["member_since"], errors="coerce", format=DATE_FORMAT)
+    member_since = parsed_since.fillna(today)
+
+    problems = pd.DataFrame(index=df.index)
+    problems["Name is missing"] = df["name"].isna()
+    problems["Date of birth is missing or invalid"] = dob.isna()
+    problems["Date of birth is in the future"] = dob > today
+    problems["Member since date is invalid"] = df["member_since"].notna() & parsed_since.isna()
+    problems["Unknown department"] = ~df["department"].isin(departments)
+
+    messages = pd.Series("", index=df.index, dtype="string")
+    for label in problems.columns:
+        messages = messages + problems[label].map({True: f"{label}; ", False: ""})
+    messages = messages.str.rstrip("; ")
+    is_valid = ~problems.any(axis=1)
+
+    report = pd.DataFrame({
+        "row": df.index + 2,  # spreadsheet row number, counting the header
+        "name": df["name"],
+        "status": is_valid.map({True: "ok", False: "error"}),
+        "problems": messages,
+    })
+
+    valid = df.loc[is_valid, ["name", "email", "phone", "address", "department"]].copy()
+    valid["dob"] = dob[is_valid].dt.strftime("%Y-%m-%d")
+    valid["member_since"] = member_since[is_valid].dt.strftime("%Y-%m-%d")
+    valid["next_renewal_date"] = (member_since[is_valid] + pd.DateOffset(years=1)).dt.strftime("%Y-%m-%d")
+    valid["member_id"] = generate_member_ids(len(valid))
+    report.loc[is_valid, "member_id"] = valid["member_id"]
+    return valid, report
+
+def import_members(valid, dry_run=False, chunk_size=1000, progress=None):
+    """Inserts validated rows in chunked transactions. Returns how many were (or would be) added."""
+    if dry_run:
+        return len(valid)
+    records = valid.astype(object).where(valid.notna(), None).to_dict("records")
+    return db.add_members(records, chunk_size=chunk_size, progress=progress)
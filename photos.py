@@ -0,0 +1,101 @@
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+import database as db
+import diagnostics
+
+# --- Ingestion Settings ---
+MAX_DIMENSION = int(os.environ.get("PHOTO_MAX_DIMENSION", "1024"))
+# The detail view shows photos at width 200; 2x keeps them sharp on high-DPI screens
+THUMBNAIL_DIMENSION = int(os.environ.get("PHOTO_THUMBNAIL_DIMENSION", "400"))
+QUALITY = int(os.environ.get("PHOTO_QUALITY", "82"))
+FORMAT = "WEBP" if features.check("webp") else "JPEG"
+
+def _encode(img, quality):
+    buf = io.BytesIO()
+    img.save(buf, format=FORMAT, quality=quality, optimize=True)
+    return buf.getvalue()
+
+def _flatten(img):
+    """Converts to RGB, compositing any transparency onto white."""
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+def process_profile_pic(raw_bytes):
+    """
+    Normalizes an uploaded photo: applies EXIF orientation, caps its size at
+    MAX_DIMENSION, re-encodes it (WebP where available) and builds a thumbnail.
+    Returns (image_bytes, thumbnail_bytes). Raises ValueError for unreadable images.
+    """
+    with diagnostics.timed("photo", "process"):
+        try:
+            img = Image.open(io.BytesIO(raw_bytes))
+            # Let the JPEG decoder downscale while decoding; much cheaper for phone photos
+            img.draft("RGB", (MAX_DIMENSION, MAX_DIMENSION))
+            img = ImageOps.exif_transpose(img)
+        except (UnidentifiedImageError, OSError) as e:
+            raise ValueError(f"Unsupported or corrupt image: {e}") from e
+
+        img = _flatten(img)
+        img.thumbnail((MAX_DIMENSION, MAX_DIMENSION), Image.LANCZOS)
+        image_bytes = _encode(img, QUALITY)
+
+        thumb = img.copy()
+        thumb.thumbnail((THUMBNAIL_DIMENSION, THUMBNAIL_DIMENSION), Image.LANCZOS)
+        return image_bytes, _encode(thumb, QUALITY)
+
+def process_profile_pics(raw_photos, max_workers=None):
+    """
+    Processes many photos on a thread pool (Pillow releases the GIL while decoding,
+    resizing and encoding). Returns a list of (image_bytes, thumbnail_bytes) or None
+    for photos that could not be read, in input order.
+    """
+    def safe_process(raw):
+        try:
+            return process_profile_pic(raw)
+        except ValueError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers or min(8, os.cpu_count() or 1)) as pool:
+        return list(pool.map(safe_process, raw_photos))
+
+# --- Background Re-encoding of Stored Photos ---
+# Photos stored before the ingestion pipeline existed have no thumbnail. This job
+# re-encodes them in batches on a background thread, off the Streamlit script thread.
+optimize_status = {"running": False, "processed": 0, "failed": 0, "error": None}
+_optimize_lock = threading.Lock()
+
+def _optimize_stored_photos(batch_size):
+    failed_hashes = set()
+    try:
+        while True:
+            rows = [r for r in db.get_profile_pics_without_thumbnails(limit=batch_size + len(failed_hashes))
+                    if r['hash'] not in failed_hashes][:batch_size]
+            if not rows:
+                break
+            for row, result in zip(rows, process_profile_pics([r['data'] for r in rows])):
+                if result is None:
+                    failed_hashes.add(row['hash'])
+                    optimize_status["failed"] += 1
+                else:
+                    db.replace_profile_pic(row['hash'], *result)
+                    optimize_status["processed"] += 1
+    except Exception as e:
+        optimize_status["error"] = str(e)
+    finally:
+        optimize_status["running"] = False
+
+def start_optimizing_stored_photos(batch_size=50):
+    """Starts the background re-encoding job unless it is already running. Returns True if started."""
+    with _optimize_lock:
+        if optimize_status["running"]:
+            return False
+        optimize_status.update(running=True, processed=0, failed=0, error=None)
+    threading.Thread(target=_optimize_stored_photos, args=(batch_size,), name="photo-optimizer", daemon=True).start()
+    return True
@@ -0,0 +1,77 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+import qrcode
+import database as db
+import diagnostics
+
+def render_qr_code(data, version=1, box_size=10, border=5):
+    """Renders a QR code for data and returns it as PNG bytes."""
+    with diagnostics.timed("qr", "render"):
+        qr = qrcode.QRCode(version=version, box_size=box_size, border=border)
+        qr.add_data(data)
+        qr.make(fit=True)
+        img = qr.make_image(fill='black', back_color='white')
+        buf = io.BytesIO()
+        img.save(buf, format="PNG")
+        return buf.getvalue()
+
+class QRCodeCache:
+    """
+    Two-level cache of rendered QR code PNGs.
+    An in-process LRU holds the most recently used images; behind it, the
+    qr_codes table in the member database keeps them across restarts.
+    """
+    def __init__(self, max_entries=256, persist=True):
+        self.max_entries = max_entries
+        self.persist = persist
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _params_key(version, box_size, border):
+        return f"v{version}-b{box_size}-m{border}"
+
+    def get(self, data, version=1, box_size=10, border=5):
+        """Returns the PNG for data, rendering and storing it on a miss."""
+        params = self._params_key(version, box_size, border)
+        key = (data, params)
+        with self._lock:
+            png = self._entries.get(key)
+            if png is not None:
+                self._entries.move_to_end(key)
+                diagnostics.increment("qr.cache_hits")
+                return png
+        diagnostics.increment("qr.cache_misses")
+
+        png = db.get_cached_qr_code(data, params) if self.persist else None
+        if png is None:
+            png = render_qr_code(data, version=version, box_size=box_size, border=border)
+            if self.persist:
+                db.save_cached_qr_code(data, params, png)
+
+        with self._lock:
+            self._entries[key] = png
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return png
+
+    def invalidate(self, data):
+        """Drops every cached rendering of data, in memory and on disk."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == data]:
+                del self._entries[key]
+        if self.persist:
+            db.delete_cached_qr_codes(data)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# Shared by every session in this server process
+qr_cache = QRCodeCache(
+    max_entries=int(os.environ.get("QR_CACHE_SIZE", "256")),
+    persist=os.environ.get("QR_CACHE_PERSIST", "1") != "0",
+)
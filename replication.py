@@ -0,0 +1,113 @@
+"""
+Incremental sync of members.db from a primary node to read-only replicas.
+
+The primary logs every change to members, departments, renewal history and photos
+(see database.export_changes). A replica applies the changes made since the last
+sequence it has, instead of copying the whole file. Deltas are gzipped JSON files.
+
+Usage:
+    python replication.py status
+    python replication.py export --since 1200 --output delta.json.gz      # on the primary
+    python replication.py apply delta.json.gz --source primary              # on a replica
+    python replication.py mark-copied --source primary                      # on a fresh full copy
+    python replication.py prune --through 1200                             # on the primary
+    python replication.py prune --older-than-days 90
+
+A new replica starts from a full copy of the primary's members.db and runs
+mark-copied once. Replicas must not be edited themselves: the primary's rows replace
+theirs by key.
+
+The change log grows with every write, so the primary prunes it: the app's scheduler
+drops entries older than SCHEDULER_CHANGE_LOG_RETENTION_DAYS (default 90), and prune
+--through drops everything every replica has applied (the lowest "primary_sync_position"
+of the replicas' status). A replica whose position is behind the pruned entries can't
+apply deltas any more; export refuses it, and it needs a new full copy plus mark-copied.
+"""
+import argparse
+import base64
+import gzip
+import json
+import sys
+import database as db
+
+FORMAT_VERSION = 1
+
+# --- Delta Files ---
+def _encode(value):
+    if isinstance(value, bytes):
+        return {"b64": base64.b64encode(value).decode("ascii")}
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def _decode(obj):
+    if len(obj) == 1 and "b64" in obj:
+        return base64.b64decode(obj["b64"])
+    return obj
+
+def write_delta(delta, out):
+    """Writes a delta from db.export_changes() to a path or binary file as gzipped JSON."""
+    with gzip.open(out, "wt", encoding="utf-8", compresslevel=6) as f:
+        json.dump({"format": FORMAT_VERSION, **delta}, f, default=_encode, separators=(",", ":"))
+
+def read_delta(source):
+    """Reads a delta written by write_delta() from a path or binary file."""
+    with gzip.open(source, "rt", encoding="utf-8") as f:
+        delta = json.load(f, object_hook=_decode)
+    if delta.get("format") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported delta format: {delta.get('format')}")
+    return delta
+
+def export_delta(out, since_seq, limit=None):
+    """Exports the changes after since_seq to `out`. Returns the delta's summary."""
+    delta = db.export_changes(since_seq, limit=limit)
+    write_delta(delta, out)
+    return {"since": delta["since"], "until": delta["until"], "changes": len(delta["changes"])}
+
+def apply_delta(source_file, source="primary"):
+    """Applies a delta file to this database. Returns the upsert/delete counts and new position."""
+    counts = db.apply_changes(read_delta(source_file), source=source)
+    return {**counts, "position": db.get_sync_position(source)}
+
+# --- Command Line ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="database path (default: MEMBERS_DB_PATH or members.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="show the change log position and replica sync positions")
+    export = commands.add_parser("export", help="write the changes after a sequence number to a file")
+    export.add_argument("--since", type=int, required=True)
+    export.add_argument("--limit", type=int, help="at most this many change log entries")
+    export.add_argument("--output", required=True)
+    apply = commands.add_parser("apply", help="apply a delta file")
+    apply.add_argument("delta")
+    apply.add_argument("--source", default="primary")
+    copied = commands.add_parser("mark-copied", help="record that this database is a full copy of the source")
+    copied.add_argument("--source", default="primary")
+    prune = commands.add_parser("prune", help="delete change log entries replicas no longer need")
+    prune_to = prune.add_mutually_exclusive_group(required=True)
+    prune_to.add_argument("--through", type=int, help="the lowest position every replica has applied")
+    prune_to.add_argument("--older-than-days", type=float)
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db.configure(db_path=args.db)
+    db.init_db()
+
+    if args.command == "status":
+        result = {"change_log_position": db.get_change_log_position(),
+                  "primary_sync_position": db.get_sync_position("primary")}
+    elif args.command == "export":
+        result = export_delta(args.output, args.since, limit=args.limit)
+    elif args.command == "apply":
+        result = apply_delta(args.delta, source=args.source)
+    elif args.command == "prune":
+        deleted = db.prune_change_log(through_seq=args.through, older_than_days=args.older_than_days)
+        result = {"deleted": deleted, "change_log_position": db.get_change_log_position()}
+    else:
+        position = db.get_change_log_position()
+        db.set_sync_position(args.source, position)
+        result = {"source": args.source, "position": position}
+    json.dump(result, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
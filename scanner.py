@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+from collections import namedtuple
+import cv2
+import numpy as np
+import diagnostics
+
+# A decoded QR code: its text and four corner points in full-frame pixel coordinates.
+ScanResult = namedtuple("ScanResult", ["data", "points"])
+
+class QRScanner:
+    """
+    QR detection for the webcam scanner.
+    Detectors are reused per thread, frames are decoded at a downscaled width,
+    only every `frame_stride`-th frame is decoded, and the area around the
+    last detected code is searched before the whole frame.
+    """
+    def __init__(self, max_width=640, frame_stride=2, roi_margin=0.5):
+        self.max_width = max_width
+        self.frame_stride = max(1, frame_stride)
+        self.roi_margin = roi_margin
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._frame_count = 0
+        self._last_result = None
+        self._stats = {
+            "frames_seen": 0,
+            "frames_decoded": 0,
+            "frames_dropped": 0,
+            "codes_found": 0,
+            "roi_hits": 0,
+            "last_decode_ms": 0.0,
+            "avg_decode_ms": 0.0,
+        }
+
+    def _detector(self):
+        detector = getattr(self._local, "detector", None)
+        if detector is None:
+            detector = self._local.detector = cv2.QRCodeDetector()
+        return detector
+
+    def _decode(self, img):
+        data, bbox, _ = self._detector().detectAndDecode(img)
+        if bbox is None or not data:
+            return None, None
+        return data, bbox.reshape(-1, 2)
+
+    def _roi(self, last_points, shape):
+        """Returns (x0, y0, x1, y1) around the last code, padded by roi_margin."""
+        height, width = shape[:2]
+        x_min, y_min = last_points.min(axis=0)
+        x_max, y_max = last_points.max(axis=0)
+        pad_x = (x_max - x_min) * self.roi_margin
+        pad_y = (y_max - y_min) * self.roi_margin
+        x0, y0 = max(int(x_min - pad_x), 0), max(int(y_min - pad_y), 0)
+        x1, y1 = min(int(x_max + pad_x), width), min(int(y_max + pad_y), height)
+        if x1 - x0 < 32 or y1 - y0 < 32:
+            return None
+        return x0, y0, x1, y1
+
+    def process(self, img):
+        """
+        Looks for a QR code in a BGR frame and returns a ScanResult or None.
+        Frames skipped by the stride return the most recent result so overlays stay steady.
+        """
+        with self._lock:
+            self._frame_count += 1
+            self._stats["frames_seen"] += 1
+            diagnostics.increment("scanner.frames_seen")
+            if (self._frame_count - 1) % self.frame_stride:
+                self._stats["frames_dropped"] += 1
+                diagnostics.increment("scanner.frames_dropped")
+                return self._last_result
+            last_result = self._last_result
+
+        start = time.perf_counter()
+        scale = min(1.0, self.max_width / img.shape[1])
+        small = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else img
+
+        data, points, roi_hit = None, None, False
+        if last_result is not None:
+            roi = self._roi(last_result.points * scale, small.shape)
+            if roi:
+                x0, y0, x1, y1 = roi
+                data, points = self._decode(small[y0:y1, x0:x1])
+                if data:
+                    points = points + np.array([x0, y0], dtype=points.dtype)
+                    roi_hit = True
+        if not data:
+            data, points = self._decode(small)
+
+        result = ScanResult(data, points / scale) if data else None
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            self._last_result = result
+            stats = self._stats
+            stats["frames_decoded"] += 1
+            stats["codes_found"] += result is not None
+            stats["roi_hits"] += roi_hit
+            stats["last_decode_ms"] = elapsed_ms
+            # Running mean over all decoded frames
+            stats["avg_decode_ms"] += (elapsed_ms - stats["avg_decode_ms"]) / stats["frames_decoded"]
+        diagnostics.record("scanner", "decode", elapsed_ms)
+        diagnostics.increment("scanner.codes_found", result is not None)
+        return result
+
+    def get_stats(self):
+        """Returns a snapshot of the frame and decode-timing counters."""
+        with self._lock:
+            return dict(self._stats)
+
+    def reset(self):
+        with self._lock:
+            self._frame_count = 0
+            self._last_result = None
+            for key in self._stats:
+                self._stats[key] = 0.0 if key.endswith("_ms") else 0
+
+class ScanChannel:
+    """
+    Hands decoded member IDs from the video thread to one session's script thread.
+    The script thread blocks in wait() until a scan is published or the timeout expires.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._value = None
+
+    def publish(self, value):
+        with self._cond:
+            self._value = value
+            self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        """Returns the latest published value (consuming it), or None on timeout."""
+        with self._cond:
+            if self._value is None:
+                self._cond.wait(timeout)
+            value, self._value = self._value, None
+            return value
+
+    def clear(self):
+        with self._cond:
+            self._value = None
+
+class ScanDeduplicator:
+    """
+    Suppresses repeat decodes of the same code: a camera held over a card decodes it
+    on every frame, but each code is only accepted once per `cooldown` seconds.
+    """
+    def __init__(self, cooldown=3.0):
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._accepted_at = {}
+
+    def accept(self, data, now=None):
+        """Returns True if `data` was not accepted within the cooldown window, and records it."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            last = self._accepted_at.get(data)
+            if last is not None and now - last < self.cooldown:
+                diagnostics.increment("scanner.duplicates_suppressed")
+                return False
+            self._accepted_at[data] = now
+            # Forget codes whose window has passed so the map stays small
+            if len(self._accepted_at) > 64:
+                self._accepted_at = {k: t for k, t in self._accepted_at.items() if now - t < self.cooldown}
+            return True
+
+    def reset(self):
+        with self._lock:
+            self._accepted_at.clear()
+
+def scanner_from_env():
+    """Builds a QRScanner using the SCANNER_* environment variables."""
+    return QRScanner(
+        max_width=int(os.environ.get("SCANNER_MAX_WIDTH", "640")),
+        frame_stride=int(os.environ.get("SCANNER_FRAME_STRIDE", "2")),
+        roi_margin=float(os.environ.get("SCANNER_ROI_MARGIN", "0.5")),
+    )
+
+def deduplicator_from_env():
+    """Builds a ScanDeduplicator using SCANNER_DEDUP_SECONDS."""
+    return ScanDeduplicator(cooldown=float(os.environ.get("SCANNER_DEDUP_SECONDS", "3.0")))
@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+import database as db
+import diagnostics
+import member_analytics
+
+logger = logging.getLogger("members.scheduler")
+
+# --- Configuration ---
+# How often the dashboard snapshots are recomputed anyway (they are also refreshed
+# shortly after any write), and how often the database statistics are refreshed.
+SNAPSHOT_INTERVAL = float(os.environ.get("SCHEDULER_SNAPSHOT_SECONDS", "900"))
+OPTIMIZE_INTERVAL = float(os.environ.get("SCHEDULER_OPTIMIZE_SECONDS", "3600"))
+ANALYZE_INTERVAL = float(os.environ.get("SCHEDULER_ANALYZE_SECONDS", "86400"))
+# Change log entries older than this are pruned once a day (0 keeps them all); replicas
+# that haven't synced for longer need a new full copy (see replication.py)
+CHANGE_LOG_RETENTION_DAYS = float(os.environ.get("SCHEDULER_CHANGE_LOG_RETENTION_DAYS", "90"))
+CHANGE_LOG_PRUNE_INTERVAL = float(os.environ.get("SCHEDULER_CHANGE_LOG_PRUNE_SECONDS", "86400"))
+# How often the runner wakes up to look for due jobs and data changes
+TICK_SECONDS = float(os.environ.get("SCHEDULER_TICK_SECONDS", "5"))
+# Maintenance jobs first run this long after start-up, out of the way of the first page loads
+MAINTENANCE_DELAY = float(os.environ.get("SCHEDULER_MAINTENANCE_DELAY_SECONDS", "120"))
+ENABLED = os.environ.get("SCHEDULER_ENABLED", "1") != "0"
+
+# Snapshots older than this many SNAPSHOT_INTERVALs are computed afresh instead of shown
+STALE_AFTER_INTERVALS = 3
+
+# Upcoming-expiry window and list length for the dashboard snapshot
+EXPIRY_WINDOW_DAYS = 30
+EXPIRY_LIST_LIMIT = 100
+
+class Job:
+    def __init__(self, name, func, interval, on_change=False, min_interval=0.0, delay=0.0):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        # Also rerun when the data version has moved on, but not within min_interval of the last run
+        self.on_change = on_change
+        self.min_interval = min_interval
+        self.next_run = time.monotonic() + delay
+        self.last_started = None
+        self.data_version = None
+        self.runs = 0
+        self.errors = 0
+        self.running = False
+        self.last_run = None
+        self.last_ms = None
+        self.last_error = None
+
+    def is_due(self, now, data_version):
+        if now >= self.next_run:
+            return True
+        changed = self.on_change and self.data_version is not None and data_version != self.data_version
+        return changed and now - self.last_started >= self.min_interval
+
+class Scheduler:
+    """
+    Runs registered jobs on a single daemon thread: each job runs every `interval`
+    seconds, and jobs flagged on_change also run soon after the data changes.
+    Job timings go to diagnostics under the "job" category.
+    """
+    def __init__(self, tick=TICK_SECONDS):
+        self.tick = tick
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add_job(self, name, func, interval, on_change=False, min_interval=0.0, delay=0.0):
+        with self._lock:
+            self._jobs[name] = Job(name, func, interval, on_change, min_interval, delay)
+
+    def start(self):
+        """Starts the runner thread unless it is already running. Returns True if started."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="members-scheduler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive() and not self._stopped.is_set()
+
+    def run_soon(self, name):
+        """Makes a job due now and wakes the runner."""
+        with self._lock:
+            self._jobs[name].next_run = 0.0
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            now = time.monotonic()
+            data_version = db.get_data_version()
+            with self._lock:
+                due = [job for job in self._jobs.values() if job.is_due(now, data_version)]
+            for job in due:
+                if self._stopped.is_set():
+                    break
+                self._run_job(job, data_version)
+            self._wakeup.wait(self.tick)
+            self._wakeup.clear()
+
+    def _run_job(self, job, data_version):
+        job.running = True
+        job.last_started = time.monotonic()
+        start = time.perf_counter()
+        try:
+            job.func()
+            job.last_error = None
+        except Exception as e:
+            job.errors += 1
+            job.last_error = str(e)
+            diagnostics.increment("scheduler.job_errors")
+            logger.exception("Scheduled job %s failed", job.name)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            job.running = False
+            job.runs += 1
+            job.last_run = datetime.now()
+            job.last_ms = elapsed_ms
+            job.data_version = data_version
+            job.next_run = time.monotonic() + job.interval
+            diagnostics.record("job", job.name, elapsed_ms)
+
+    def get_status(self):
+        """Returns one dict per job with its schedule, last run and timing."""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [{
+            "name": job.name, "interval_s": job.interval, "on_change": job.on_change, "running": job.running,
+            "runs": job.runs, "errors": job.errors, "last_run": job.last_run, "last_ms": job.last_ms,
+            "last_error": job.last_error,
+        } for job in jobs]
+
+# --- Jobs ---
+def compute_dashboard_stats(today):
+    return {"as_of": today, **db.get_dashboard_stats(today, due_within_days=EXPIRY_WINDOW_DAYS)}
+
+def compute_upcoming_expiries(today):
+    rows = db.get_upcoming_expiries(today, within_days=EXPIRY_WINDOW_DAYS, limit=EXPIRY_LIST_LIMIT)
+    return {"as_of": today, "members": [dict(row) for row in rows]}
+
+def compute_department_totals(today):
+    frame = db.get_members_frame(columns=('department', 'dob', 'next_renewal_date'))
+    summary = member_analytics.department_summary(frame, today, due_within_days=EXPIRY_WINDOW_DAYS)
+    return {"as_of": today, "departments": json.loads(summary.reset_index().to_json(orient="records"))}
+
+SNAPSHOTS = {
+    "dashboard_stats": compute_dashboard_stats,
+    "upcoming_expiries": compute_upcoming_expiries,
+    "department_totals": compute_department_totals,
+}
+
+def refresh_dashboard_snapshot():
+    db.save_snapshot("dashboard_stats", compute_dashboard_stats(date.today()))
+
+def refresh_expiry_snapshot():
+    db.save_snapshot("upcoming_expiries", compute_upcoming_expiries(date.today()))
+
+def refresh_department_snapshot():
+    db.save_snapshot("department_totals", compute_department_totals(date.today()))
+
+def current_snapshot(name):
+    """
+    Returns (data, computed_at) for one of SNAPSHOTS: the stored snapshot while this
+    process's scheduler is running and it is recent, otherwise computed now (the
+    scheduler is disabled or has died, or the snapshot doesn't exist yet).
+    """
+    if scheduler.is_running():
+        snapshot = db.get_snapshot(name)
+        if snapshot and datetime.now() - snapshot[1] <= timedelta(seconds=STALE_AFTER_INTERVALS * SNAPSHOT_INTERVAL):
+            return snapshot
+    return SNAPSHOTS[name](date.today()), datetime.now()
+
+# --- Process-wide Scheduler ---
+scheduler = Scheduler()
+scheduler.add_job("dashboard_snapshot", refresh_dashboard_snapshot, SNAPSHOT_INTERVAL, on_change=True)
+scheduler.add_job("expiry_snapshot", refresh_expiry_snapshot, SNAPSHOT_INTERVAL, on_change=True)
+# Loads every member, so data changes refresh it at most once a minute
+scheduler.add_job("department_snapshot", refresh_department_snapshot, SNAPSHOT_INTERVAL, on_change=True, min_interval=60)
+scheduler.add_job("pragma_optimize", db.optimize_database, OPTIMIZE_INTERVAL, delay=MAINTENANCE_DELAY)
+scheduler.add_job("analyze", lambda: db.optimize_database(analyze=True), ANALYZE_INTERVAL, delay=MAINTENANCE_DELAY)
+if CHANGE_LOG_RETENTION_DAYS > 0:
+    scheduler.add_job("change_log_prune", lambda: db.prune_change_log(older_than_days=CHANGE_LOG_RETENTION_DAYS),
+                      CHANGE_LOG_PRUNE_INTERVAL, delay=MAINTENANCE_DELAY)
+
+def start():
+    """Starts the process-wide scheduler once; later calls (every Streamlit rerun) do nothing."""
+    if ENABLED:
+        scheduler.start()